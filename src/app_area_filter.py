@@ -1,4 +1,3 @@
-import operator
 import tkinter as tk
 from tkinter import ttk
 
@@ -117,7 +116,7 @@ class App(ttk.Frame):
         isin_df = keypoints_proc.is_in_poly(self.src_df, poly_points, "is_remove", self.scale)
         # area内を削除したいときはboolを反転する
         if self.in_out_combo.get() == "within area":
-            isin_df = isin_df.map(operator.not_)
+            isin_df = ~isin_df
 
         dst_df = pd.concat([self.src_df, isin_df], axis=1)
         k_m_bool = self.keypoint_member_combo.get() == "member"
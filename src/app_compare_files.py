@@ -10,7 +10,7 @@ import seaborn as sns
 import ttkthemes
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
-from behavior_senpai import df_attrs, hdf_df, keypoints_proc, time_format, windows_and_mac
+from behavior_senpai import df_attrs, file_inout, hdf_df, keypoints_proc, time_format, windows_and_mac
 from gui_parts import Combobox, IntEntry, TempFile
 from gui_tree import Tree
 
@@ -155,6 +155,7 @@ class App(ttk.Frame):
 
     def load_keypoint_files(self, tar_path):
         self.tar_pkl_list = glob.glob(os.path.join(tar_path, "*.pkl"))
+        self.tar_pkl_list += glob.glob(os.path.join(tar_path, f"*{file_inout.TRACK_FILE_EXT}"))
         # remove feature files
         self.tar_pkl_list = [f for f in self.tar_pkl_list if not f.endswith(".feat")]
         file_num = len(self.tar_pkl_list)
@@ -163,7 +164,7 @@ class App(ttk.Frame):
         keypoint_list = []
         scene_list = []
         for file_path in self.tar_pkl_list:
-            src_df = pd.read_pickle(file_path)
+            src_df = file_inout.read_track_file(file_path)
             idx = src_df.index
             src_df.index = src_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str), idx.levels[2]])
 
@@ -194,14 +195,16 @@ class App(ttk.Frame):
             # get scene_table from attrs
             profile = h5.load_profile()
             dir_path = os.path.dirname(file_path)
-            trk_path = os.path.join(dir_path, "..", "..", "trk", profile["track_name"])
-            if not os.path.exists(trk_path):
-                trk_path = os.path.join(dir_path, "..", "trk", profile["track_name"])
-            if os.path.exists(trk_path):
-                trk_df = pd.read_pickle(trk_path)
-            src_attrs = df_attrs.DfAttrs(trk_df)
-            src_attrs.load_scene_table()
-            scene_list += src_attrs.get_scene_descriptions(add_blank=True)
+            trk_path = file_inout.find_track_file(os.path.join(dir_path, "..", "..", "trk", profile["track_name"]))
+            if trk_path is None:
+                trk_path = file_inout.find_track_file(os.path.join(dir_path, "..", "trk", profile["track_name"]))
+            if trk_path is None:
+                print(f"Track file not found: {profile['track_name']}")
+            else:
+                trk_df = file_inout.read_track_file(trk_path)
+                src_attrs = df_attrs.DfAttrs(trk_df)
+                src_attrs.load_scene_table()
+                scene_list += src_attrs.get_scene_descriptions(add_blank=True)
 
             # get DataFrame
             points_df = h5.load_points_df()
@@ -351,9 +354,9 @@ class App(ttk.Frame):
             src_df.index = src_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str)])
             profile_dict = h5.load_profile()
             now_dir = os.path.dirname(file_path)
-            pkl_path = os.path.join(now_dir, "..", "..", "trk", profile_dict["track_name"])
-            if os.path.exists(pkl_path):
-                trk_df = pd.read_pickle(pkl_path)
+            pkl_path = file_inout.find_track_file(os.path.join(now_dir, "..", "..", "trk", profile_dict["track_name"]))
+            if pkl_path is not None:
+                trk_df = file_inout.read_track_file(pkl_path)
                 scene_table = trk_df.attrs["scene_table"]
                 src_df.attrs["scene_table"] = scene_table
 
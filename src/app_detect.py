@@ -58,6 +58,27 @@ class App(ttk.Frame):
         )
         self.engine_combo.pack_horizontal(padx=(10, 0))
 
+        self.batch_combo = Combobox(
+            bat_mode_frame, "Batch:", values=["1", "2", "4", "8", "16"], width=4
+        )
+        self.batch_combo.pack_horizontal(padx=(10, 0))
+
+        self.stride_combo = Combobox(
+            bat_mode_frame, "Stride:", values=["1", "2", "3", "4", "5", "10"], width=4
+        )
+        self.stride_combo.pack_horizontal(padx=(10, 0))
+
+        self.infer_height_combo = Combobox(
+            bat_mode_frame, "Height:", values=["Original", "1440", "1080", "720"], width=8
+        )
+        self.infer_height_combo.pack_horizontal(padx=(10, 0))
+
+        interp_desc = "If checked, fills the frames skipped by the stride with linear interpolation."
+        self.interp_chk = Checkbutton(
+            bat_mode_frame, "Interpolate", description=interp_desc
+        )
+        self.interp_chk.pack_horizontal(padx=(10, 0))
+
         top_btn_frame = ttk.Frame(self)
         top_btn_frame.pack(pady=14)
         self.select_video_btn = ttk.Button(
@@ -139,8 +160,21 @@ class App(ttk.Frame):
         model_name = self.engine_combo.get()
         use_roi = self.roi_chk.get()
         add_suffix = self.add_suffix_chk.get()
+        batch_size = int(self.batch_combo.get())
+        stride = int(self.stride_combo.get())
+        interpolate = self.interp_chk.get()
+        infer_height = self.infer_height_combo.get()
+        infer_height = None if infer_height == "Original" else int(infer_height)
         self.trk_path = detector_proc.exec(
-            self.rcap, model_name, video_path, use_roi, add_suffix
+            self.rcap,
+            model_name,
+            video_path,
+            use_roi,
+            add_suffix,
+            batch_size,
+            stride=stride,
+            interpolate=interpolate,
+            infer_height=infer_height,
         )
 
     def _on_bat_mode_changed(self, *args):
@@ -3,7 +3,7 @@ import tkinter as tk
 from tkinter import filedialog, ttk
 
 import gui_parts
-from behavior_senpai import deeplabcut_hdf
+from behavior_senpai import deeplabcut_hdf, file_inout
 
 
 class App(ttk.Frame):
@@ -80,8 +80,8 @@ class App(ttk.Frame):
         os.makedirs(trk_dir, exist_ok=True)
 
         # save track file
-        trk_path = os.path.join(trk_dir, os.path.splitext(video_name)[0] + "_dlc.pkl")
-        df.to_pickle(trk_path)
+        trk_path = os.path.join(trk_dir, os.path.splitext(video_name)[0] + "_dlc" + file_inout.TRACK_FILE_EXT)
+        file_inout.write_track_file(trk_path, df)
         self.trk_path = trk_path
         print(f"Track file saved to {trk_path}")
         self.master.destroy()
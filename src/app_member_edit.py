@@ -3,8 +3,10 @@ from tkinter import ttk
 
 import pandas as pd
 
-from behavior_senpai import keypoints_proc, time_format
-from gui_parts import StrEntry, TempFile, TimeSpanEntry
+from behavior_senpai import keypoints_proc, time_format, track_stitcher
+from behavior_senpai.member_summary import MemberSummary
+from behavior_senpai.member_table import MemberTable
+from gui_parts import IntEntry, StrEntry, TempFile, TimeSpanEntry
 from gui_tree import Tree
 from line_plotter import LinePlotter
 
@@ -47,6 +49,15 @@ class App(ttk.Frame):
         self.time_span_entry = TimeSpanEntry(rename_frame)
         self.time_span_entry.pack(side=tk.LEFT)
 
+        stitch_frame = ttk.Frame(setting_frame)
+        stitch_frame.pack(pady=5)
+        self.max_gap_entry = IntEntry(stitch_frame, label="Max gap (msec):", default=1000, width=6)
+        self.max_gap_entry.pack_horizontal(padx=(0, 5))
+        self.max_distance_entry = IntEntry(stitch_frame, label="Max distance (px):", default=100, width=6)
+        self.max_distance_entry.pack_horizontal(padx=(0, 5))
+        stitch_btn = ttk.Button(stitch_frame, text="Auto Stitch", command=self.stitch_members)
+        stitch_btn.pack(side=tk.LEFT, padx=5)
+
         tree_canvas_frame = ttk.Frame(self)
         tree_canvas_frame.pack(padx=10, pady=5, fill=tk.X, expand=True)
 
@@ -84,10 +95,14 @@ class App(ttk.Frame):
         self._load(args)
 
     def _load(self, args):
-        self.src_df = args["src_df"].copy()
+        # src_dfはコピーせず、renameとremoveはmember_tableに記録してOKのときにDataFrameを作る
+        self.member_table = MemberTable(args["src_df"])
         self.time_min, self.time_max = args["time_span_msec"]
-        idx = self.src_df.index
-        self.src_df.index = self.src_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str), idx.levels[2]])
+        # Launcherが前回の集計を持っていればそれを使う、編集はコピーに対して行う
+        if args.get("member_summary") is not None:
+            self.member_summary = args["member_summary"].copy()
+        else:
+            self.member_summary = MemberSummary(self.member_table)
 
         # Update GUI
         self.update_tree()
@@ -97,8 +112,7 @@ class App(ttk.Frame):
         self.band.clear()
         self.band.set_vcap(args["cap"])
 
-        members = self.src_df.dropna().index.get_level_values(1).unique()
-        print(f"members: {len(members)}")
+        print(f"members: {len(self.member_summary.summary_df)}")
 
     def draw(self):
         """Draw the selected member's keypoints within the specified timestamp range."""
@@ -106,7 +120,8 @@ class App(ttk.Frame):
         if row is None:
             return
 
-        tar_df = keypoints_proc.filter_by_timerange(self.src_df, self.time_min, self.time_max)
+        member_df = self.member_table.get_member_df(row[0])
+        tar_df = keypoints_proc.filter_by_timerange(member_df, self.time_min, self.time_max)
         tar_df = tar_df[~tar_df.index.duplicated(keep="last")]
 
         idx = tar_df.index
@@ -124,29 +139,9 @@ class App(ttk.Frame):
         self.band.draw()
 
     def update_tree(self):
-        """Update the treeview widget with the data from the src_df."""
+        """Update the treeview widget with the data from the member summary."""
         self.tree.clear()
-        members = self.src_df.index.get_level_values(1).unique()
-        tree_df = self.src_df
-
-        for member in members:
-            sliced_df = tree_df.loc[pd.IndexSlice[:, member, :], :]
-            sliced_df = sliced_df.loc[~(sliced_df["x"].isna()) & (~sliced_df["y"].isna())]
-            if len(sliced_df.index.get_level_values(0).unique()) == 0:
-                print(f"member {member} has no data")
-                continue
-            kpf = len(sliced_df) / len(sliced_df.index.get_level_values(0).unique())
-            head_timestamp = time_format.msec_to_timestr_with_fff(sliced_df.head(1)["timestamp"].values[0])
-            tail_timestamp = time_format.msec_to_timestr_with_fff(sliced_df.tail(1)["timestamp"].values[0])
-            duration = sliced_df.tail(1)["timestamp"].values[0] - sliced_df.head(1)["timestamp"].values[0]
-            duration_str = time_format.msec_to_timestr_with_fff(duration)
-            values = [
-                member,
-                head_timestamp,
-                tail_timestamp,
-                duration_str,
-                f"{kpf:.2f}",
-            ]
+        for values in self.member_summary.get_tree_rows():
             self.tree.insert(values)
         # select current_member
         current_member = self.tar_member_label_var.get()
@@ -161,21 +156,23 @@ class App(ttk.Frame):
         if new_member == "":
             print("new member name is empty")
             return
-        # self.time_min self.time_maxの間でかつ変更したいmemberを抽出
         start_time, end_time = self.time_span_entry.get_start_end()
-        between_sr = self.src_df["timestamp"].between(start_time - 1, end_time + 1)
-        tar_member_sr = self.src_df.index.get_level_values(1) == old_member
-        rename_sr = between_sr & tar_member_sr
-        # new_memberを追加してmemberと入れ替える
-        new_member_sr = self.src_df.index.get_level_values(1).where(~rename_sr, new_member)
-        self.src_df["new_member"] = new_member_sr
-        self.src_df = self.src_df.set_index("new_member", append=True).swaplevel()
-        self.src_df = self.src_df.droplevel(level="member").rename_axis(index={"new_member": "member"})
-
-        self.src_df = self.src_df[~self.src_df.index.duplicated(keep="last")]
+        self.member_table.rename(old_member, new_member, start_time, end_time)
+        self.member_summary.update(self.member_table, [old_member, new_member])
         self.update_tree()
         print(f"renamed {old_member} to {new_member}")
 
+    def stitch_members(self):
+        """Connect fragmented members automatically and rename them to the first member of each chain."""
+        mapping = track_stitcher.stitch_members(self.member_table, self.max_gap_entry.get(), self.max_distance_entry.get())
+        if len(mapping) == 0:
+            print("no members to stitch")
+            return
+        self.member_table.rename_members(mapping)
+        self.member_summary.update(self.member_table, list(mapping.keys()) + list(mapping.values()))
+        self.update_tree()
+        print(f"stitched {len(mapping)} members into {len(set(mapping.values()))} members")
+
     def remove_member(self):
         """Remove a member from the DataFrame."""
         selected = self.tree.get_selected()
@@ -184,20 +181,18 @@ class App(ttk.Frame):
         elif len(selected) > 1:
             for sel in selected:
                 tar_member = str(sel[0])
-                remove_sr = self.src_df.index.get_level_values(1) == tar_member
-                self.src_df = self.src_df[~remove_sr]
-                self.update_tree()
+                self.member_table.remove(tar_member)
                 print(f"removed {tar_member}")
+            self.member_summary.update(self.member_table, [str(sel[0]) for sel in selected])
+            self.update_tree()
         else:
             current_member = str(selected[0][0])
             if current_member == "":
                 print("current member is empty")
                 return
             start_time, end_time = self.time_span_entry.get_start_end()
-            between_sr = self.src_df["timestamp"].between(start_time - 1, end_time + 1)
-            tar_member_sr = self.src_df.index.get_level_values(1) == current_member
-            remove_sr = between_sr & tar_member_sr
-            self.src_df = self.src_df[~remove_sr]
+            self.member_table.remove(current_member, start_time, end_time)
+            self.member_summary.update(self.member_table, [current_member])
             self.update_tree()
             print(f"removed {current_member}")
 
@@ -216,7 +211,8 @@ class App(ttk.Frame):
 
     def on_ok(self):
         """Perform the action when the 'OK' button is clicked."""
-        self.dst_df = self.src_df.copy()
+        # 削除した行はここで詰める
+        self.dst_df = self.member_table.to_dataframe()
         if len(self.dst_df) == 0:
             print("No data in DataFrame")
             self.dst_df = None
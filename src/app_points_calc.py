@@ -117,49 +117,26 @@ class App(ttk.Frame):
 
     def draw(self):
         self.lineplot.clear()
-        self.feat_df = pd.DataFrame()
         self.source_cols = self.tree.get_all()
 
         # thinning for plotting
         thinning = self.thinning_entry.get()
         self.thinning_entry.save_to_temp("thinning")
         members = list(set([str(x[1]) for x in self.source_cols]))
-        for member in members:
-            member_df = self.tar_df.loc[pd.IndexSlice[:, member], :].drop("timestamp", axis=1)
-            member_feat_df = pd.DataFrame()
-
-            for calc, m, point_a, point_b, point_c in self.source_cols:
-                if member != str(m):
-                    continue
-                code = self.tree.get_name_and_code(calc)
-                point_a, point_b = int(point_a), int(point_b)
-                if code == "norm":
-                    plot_df = keypoints_proc.calc_norm(member_df, point_a, point_b)
-                elif code == "sin_cos":
-                    plot_df = keypoints_proc.calc_sin_cos(member_df, point_a, point_b, int(point_c))
-
-                elif code == "component":
-                    plot_df = keypoints_proc.calc_xy_component(member_df, point_a, point_b)
-                elif code == "cross":
-                    plot_df = keypoints_proc.calc_cross_product(member_df, point_a, point_b, int(point_c))
-                elif code == "dot":
-                    plot_df = keypoints_proc.calc_dot_product(member_df, point_a, point_b, int(point_c))
-                elif code == "plus":
-                    plot_df = keypoints_proc.calc_plus(member_df, point_a, point_b, int(point_c))
-                elif code == "norms":
-                    plot_df = keypoints_proc.calc_norms(member_df, point_a, point_b, int(point_c))
-                elif code == "direction":
-                    plot_df = keypoints_proc.calc_direction(member_df, point_a, point_b)
-
-                col_names = plot_df.columns.tolist()
-                # concat right
-                member_feat_df = pd.concat([member_feat_df, plot_df], axis=1)
-
-                plot_df["timestamp"] = self.tar_df.loc[pd.IndexSlice[:, :, point_a], :].droplevel(2)["timestamp"]
-                thinned_df = keypoints_proc.thinning(plot_df, thinning)
-                self.lineplot.set_plot(thinned_df, member, col_names)
-            # concat bottom
-            self.feat_df = pd.concat([self.feat_df, member_feat_df], axis=0)
+        specs = []
+        for calc, member, point_a, point_b, point_c in self.source_cols:
+            code = self.tree.get_name_and_code(calc)
+            point_c = int(point_c) if str(point_c) != "" else None
+            specs.append((code, str(member), int(point_a), int(point_b), point_c))
+        # すべての計算を1回でまとめて行う
+        calc_df = keypoints_proc.calc_points(self.tar_df, specs)
+        self.feat_df = calc_df.drop(columns="timestamp")
+
+        for code, member, point_a, point_b, point_c in specs:
+            col_names = keypoints_proc.get_points_col_names(code, point_a, point_b, point_c)
+            plot_df = calc_df.loc[pd.IndexSlice[:, member], col_names + ["timestamp"]]
+            thinned_df = keypoints_proc.thinning(plot_df, thinning)
+            self.lineplot.set_plot(thinned_df, member, col_names)
 
         self.lineplot.set_legend_of_plot()
         self.lineplot.draw()
@@ -5,7 +5,7 @@ from tkinter import messagebox, ttk
 
 import pandas as pd
 
-from behavior_senpai import windows_and_mac
+from behavior_senpai import file_inout, windows_and_mac
 from gui_parts import Combobox, IntEntry, StrEntry
 
 
@@ -36,6 +36,8 @@ class App(ttk.Frame):
         overwrite_btn.pack(padx=(25, 5), side=tk.LEFT)
         merge_btn = ttk.Button(take_part_frame, text="Merge track files", command=self.merge)
         merge_btn.pack(padx=5, side=tk.LEFT)
+        convert_btn = ttk.Button(take_part_frame, text="Convert to .trk", command=self.convert)
+        convert_btn.pack(padx=5, side=tk.LEFT)
 
         open_btn = ttk.Button(take_part_frame, text="Open video", command=self._open_video)
         open_btn.pack(padx=5, side=tk.LEFT)
@@ -66,17 +68,18 @@ class App(ttk.Frame):
         self.src_tl = TrackList()
 
         trk_paths = glob.glob(os.path.join(self.folder_path, "*.pkl"))
+        trk_paths += glob.glob(os.path.join(self.folder_path, f"*{file_inout.TRACK_FILE_EXT}"))
         attr_dict = {}
         for trk_path in trk_paths:
             take, prev_name, next_name = "", None, None
-            tar_df = pd.read_pickle(trk_path)
-            if "take" in tar_df.attrs.keys():
-                take = tar_df.attrs["take"]
-            if "next" in tar_df.attrs.keys():
-                next_name = tar_df.attrs["next"]
-            if "prev" in tar_df.attrs.keys():
-                prev_name = tar_df.attrs["prev"]
-            attr_dict[os.path.basename(trk_path)] = {"model": tar_df.attrs["model"], "video": tar_df.attrs["video_name"]}
+            tar_attrs = file_inout.read_track_attrs(trk_path)
+            if "take" in tar_attrs.keys():
+                take = tar_attrs["take"]
+            if "next" in tar_attrs.keys():
+                next_name = tar_attrs["next"]
+            if "prev" in tar_attrs.keys():
+                prev_name = tar_attrs["prev"]
+            attr_dict[os.path.basename(trk_path)] = {"model": tar_attrs["model"], "video": tar_attrs["video_name"]}
             self.src_tl.append(take, prev_name, next_name, os.path.basename(trk_path))
 
         take_dict = self.src_tl.get_dict()
@@ -136,17 +139,17 @@ class App(ttk.Frame):
                 if take == src_take and item.name == src_item.name and item.prev == src_item.prev and item.next == src_item.next:
                     print(f"same! {item.name} and {src_item.name}")
                 elif take == "":
-                    tar_df = pd.read_pickle(os.path.join(self.folder_path, item.name))
+                    tar_df = file_inout.read_track_file(os.path.join(self.folder_path, item.name))
                     tar_df.attrs["prev"] = None
                     tar_df.attrs["next"] = None
                     tar_df.attrs["take"] = ""
-                    tar_df.to_pickle(os.path.join(self.folder_path, item.name))
+                    file_inout.write_track_file(os.path.join(self.folder_path, item.name), tar_df)
                 else:
-                    tar_df = pd.read_pickle(os.path.join(self.folder_path, item.name))
+                    tar_df = file_inout.read_track_file(os.path.join(self.folder_path, item.name))
                     tar_df.attrs["prev"] = item.prev
                     tar_df.attrs["next"] = item.next
                     tar_df.attrs["take"] = take
-                    tar_df.to_pickle(os.path.join(self.folder_path, item.name))
+                    file_inout.write_track_file(os.path.join(self.folder_path, item.name), tar_df)
         print("overwrite done")
         self._load_folder()
 
@@ -175,6 +178,12 @@ class App(ttk.Frame):
                 self._merge_track_files(take, part_list)
         messagebox.showinfo("Merge track files", "Merge finished.")
 
+    def convert(self):
+        """Convert the pickled track files in the folder to .trk files."""
+        trk_names = file_inout.convert_pkl_to_trk(self.folder_path)
+        messagebox.showinfo("Convert track files", f"{len(trk_names)} files converted.")
+        self._load_folder()
+
     def close(self):
         pass
 
@@ -182,7 +191,7 @@ class App(ttk.Frame):
         dst_df = pd.DataFrame()
         videos = []
         for file_name in file_name_list:
-            src_df = pd.read_pickle(os.path.join(self.folder_path, file_name))
+            src_df = file_inout.read_track_file(os.path.join(self.folder_path, file_name))
             if len(dst_df) == 0:
                 dst_df = src_df
                 attrs = src_df.attrs
@@ -208,8 +217,8 @@ class App(ttk.Frame):
         attrs["next"] = None
         attrs["video_name"] = videos
         dst_df.attrs = attrs
-        dst_path = os.path.join(self.folder_path, take_name + ".pkl")
-        dst_df.to_pickle(dst_path)
+        dst_path = os.path.join(self.folder_path, take_name + file_inout.TRACK_FILE_EXT)
+        file_inout.write_track_file(dst_path, dst_df)
 
 
 class TrackList:
@@ -4,7 +4,7 @@ from tkinter import ttk
 
 import pandas as pd
 
-from behavior_senpai import df_attrs, hdf_df, keypoints_proc
+from behavior_senpai import df_attrs, hdf_df, keypoints_proc, kinematics
 from gui_parts import IntEntry, MemberKeypointComboboxes, TempFile
 from trajectory_plotter import TrajectoryPlotter
 
@@ -56,6 +56,9 @@ class App(ttk.Frame):
         idx = self.tar_df.index
         self.tar_df.index = self.tar_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str), idx.levels[2].astype(int)])
 
+        # 速さはdt_spanごとにキャッシュされるので、keypointを変えて描き直しても再計算しない
+        self.kinematics = kinematics.Kinematics(self.tar_df)
+
         self.traj.set_vcap(args["cap"])
         self.track_name = args["trk_pkl_name"]
         self.src_attrs = df_attrs.DfAttrs(src_df)
@@ -68,14 +71,15 @@ class App(ttk.Frame):
         current_member, current_keypoint = self.member_keypoints_combos.get_selected()
         self.timestamp_df = self.tar_df.loc[:, "timestamp"].droplevel(2).to_frame()
 
-        # speedを計算してsrc_dfに追加
+        # 選んだkeypointの行だけにspeedを追加
         dt_span = self.diff_entry.get()
-        speed_df = keypoints_proc.calc_speed(self.tar_df, int(dt_span))
-        plot_df = pd.concat([self.tar_df, speed_df], axis=1)
+        speed_df = self.kinematics.to_dataframe([int(dt_span)])
+        is_keypoint = self.tar_df.index.get_level_values("keypoint") == int(current_keypoint)
+        plot_df = pd.concat([self.tar_df.loc[is_keypoint, :], speed_df.loc[is_keypoint, :]], axis=1)
         self.current_dt_span = dt_span
 
         # make export data
-        calc_df = plot_df.loc[pd.IndexSlice[:, :, int(current_keypoint)], :].droplevel(2)
+        calc_df = plot_df.droplevel(2)
         calc_df = calc_df.drop(columns="timestamp").add_suffix(f"({current_keypoint})")
         self.feat_df = pd.concat([self.feat_df, calc_df], axis=1)
 
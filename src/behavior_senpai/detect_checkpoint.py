@@ -0,0 +1,110 @@
+import json
+import os
+
+import pandas as pd
+
+# 何フレームごとに途中結果をファイルに書き出すか
+CHECKPOINT_FRAMES = 1800
+CHECKPOINT_KEY = "chunks"
+META_KEY = "meta"
+
+
+def get_checkpoint_path(trk_path):
+    return f"{trk_path}.part"
+
+
+class Checkpoint:
+    """
+    検出の途中結果をTrack fileの横の.partファイル(HDF5)にchunkとして追記する
+    最後に検出が終わったフレーム番号も保存し、同じ動画を再度検出したときはその次のフレームから再開する
+    settings(stride, ROI, infer_heightなど)が前回と違う場合は再開しない
+    """
+
+    def __init__(self, trk_path, model_name, video_path, settings=None, interval=CHECKPOINT_FRAMES):
+        self.file_path = get_checkpoint_path(trk_path)
+        self.model_name = model_name
+        stat = os.stat(video_path)
+        self.video_stat = [stat.st_size, stat.st_mtime]
+        # HDF5のtableに入れるため文字列にして比較する
+        self.settings = json.dumps(settings if settings is not None else {}, sort_keys=True)
+        self.interval = interval
+        self.last_frame = -1
+        self.flushed_frame = -1
+        # 書き出したmember IDの最大値、再開したときにtrackerのIDが重ならないようにずらすのに使う
+        self.max_member = -1
+
+    def get_start_frame(self):
+        """
+        再開するフレーム番号を返す
+        別のモデルや設定の結果、動画が変更されていた場合は.partを削除して0から始める
+        """
+        if os.path.exists(self.file_path) is False:
+            return 0
+        try:
+            with pd.HDFStore(self.file_path, mode="r") as store:
+                meta = store.get(META_KEY).iloc[0]
+            is_valid = (
+                meta["model_name"] == self.model_name
+                and [meta["video_size"], meta["video_mtime"]] == self.video_stat
+                and meta["settings"] == self.settings
+            )
+            last_frame = int(meta["last_frame"])
+            max_member = int(meta["max_member"])
+        except (OSError, KeyError):
+            is_valid = False
+        if is_valid is False:
+            print(f"Discard checkpoint: {os.path.basename(self.file_path)}")
+            self.remove()
+            return 0
+        self.last_frame = last_frame
+        self.flushed_frame = last_frame
+        self.max_member = max_member
+        print(f"Resume from frame {last_frame + 1}: {os.path.basename(self.file_path)}")
+        return last_frame + 1
+
+    def update(self, buffer, frame_num, force=False):
+        """
+        frame_numまで検出が終わったことを記録し、interval毎にbufferの中身を書き出して空にする
+        """
+        self.last_frame = frame_num
+        if force is False and frame_num - self.flushed_frame < self.interval:
+            return
+        chunk_df = buffer.to_dataframe().reset_index()
+        if len(chunk_df) > 0 and pd.api.types.is_integer_dtype(chunk_df["member"]):
+            self.max_member = max(self.max_member, int(chunk_df["member"].max()))
+        meta = pd.DataFrame(
+            [
+                {
+                    "model_name": self.model_name,
+                    "video_size": self.video_stat[0],
+                    "video_mtime": self.video_stat[1],
+                    "settings": self.settings,
+                    "last_frame": self.last_frame,
+                    "max_member": self.max_member,
+                }
+            ]
+        )
+        with pd.HDFStore(self.file_path, mode="a") as store:
+            # 誰も検出されなかった区間はchunkを書かずにlast_frameだけ更新する
+            if len(chunk_df) > 0:
+                # memberが文字列の場合に備えて長さに余裕を持たせる
+                min_itemsize = {"member": 32} if chunk_df["member"].dtype == object else None
+                store.append(CHECKPOINT_KEY, chunk_df, format="table", index=False, min_itemsize=min_itemsize)
+            store.put(META_KEY, meta, format="table", min_itemsize={"settings": 256})
+        buffer.clear()
+        self.flushed_frame = frame_num
+
+    def load(self, buffer):
+        """
+        書き出したchunkをすべて読み込んで(frame, member, keypoint)のDataFrameにする
+        chunkが1つもなければbufferと同じカラムの空のDataFrameを返す
+        """
+        with pd.HDFStore(self.file_path, mode="r") as store:
+            if f"/{CHECKPOINT_KEY}" not in store.keys():
+                return buffer.to_dataframe()
+            chunk_df = store.select(CHECKPOINT_KEY)
+        return chunk_df.set_index(["frame", "member", "keypoint"])
+
+    def remove(self):
+        if os.path.exists(self.file_path) is True:
+            os.remove(self.file_path)
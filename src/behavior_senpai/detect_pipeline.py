@@ -0,0 +1,138 @@
+import queue
+import threading
+
+import cv2
+
+from behavior_senpai import img_draw, vcap
+
+# デコード済みフレームを先読みしておく数
+PREFETCH_FRAMES = 32
+
+
+class FrameReader:
+    """
+    別スレッドで動画をデコードし、(frame番号, frame, timestamp)をキューに先読みする
+    キューに上限があるので、推論が遅くてもメモリ使用量は増え続けない
+    """
+
+    def __init__(self, cap, total_frame_num, maxsize=PREFETCH_FRAMES, start_frame=0, stride=1):
+        self.cap = cap
+        self.total_frame_num = total_frame_num
+        self.start_frame = start_frame
+        # strideフレームおきに読み込む、間のフレームはgrab()だけでデコードしない
+        self.stride = stride
+        # 最後のフレームまで読み終わったらTrue
+        self.finished = False
+        # 読み込みスレッドで起きた例外、batches()で投げ直す
+        self.error = None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def batches(self, batch_size):
+        """
+        フレームをbatch_size個ずつのリストにして返す
+        """
+        batch = []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                if self.error is not None:
+                    raise self.error
+                self.finished = True
+                break
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def stop(self):
+        """
+        途中終了したときに読み込みスレッドを止める
+        """
+        self.stop_event.set()
+        # キューが満杯でput()で止まっているスレッドを動かすために読み捨てる
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+    def _read(self):
+        try:
+            if self.start_frame > 0:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+            for i in range(self.start_frame, self.total_frame_num):
+                if self.stop_event.is_set():
+                    break
+                if i % self.stride != 0:
+                    self.cap.grab()
+                    continue
+                # ROIを指定していなければフレーム全体、推論の解像度に縮小して返る
+                ret, frame = self.cap.get_roi_frame()
+                if ret is False:
+                    print("Failed to read frame.")
+                    continue
+                timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+                self.queue.put((i, frame, timestamp))
+        except Exception as e:
+            self.error = e
+        finally:
+            # 例外で抜けてもbatches()が止まったままにならないように必ず終わりを知らせる
+            self.queue.put(None)
+
+
+class PreviewRenderer:
+    """
+    検出結果の描画を別スレッドで行う
+    描画が追いつかないフレームは飛ばす、cv2.imshow()はメインスレッドでshow()から呼ぶ
+    """
+
+    def __init__(self, draw_func, total_frame_num):
+        self.draw_func = draw_func
+        self.total_frame_num = total_frame_num
+        self.queue = queue.Queue(maxsize=1)
+        self.lock = threading.Lock()
+        self.dst_img = None
+        self.thread = threading.Thread(target=self._render, daemon=True)
+        self.thread.start()
+
+    def put(self, frame_num, frame, result):
+        try:
+            self.queue.put_nowait((frame_num, frame, result))
+        except queue.Full:
+            pass
+
+    def show(self):
+        """
+        最新の描画結果を表示する、xキーが押されたらTrueを返す
+        """
+        with self.lock:
+            dst_img = self.dst_img
+            self.dst_img = None
+        if dst_img is not None:
+            cv2.imshow("dst", dst_img)
+        key = cv2.waitKey(1) & 0xFF
+        return key == ord("x")
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+        cv2.destroyAllWindows()
+
+    def _render(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame_num, frame, result = item
+            dst_img = self.draw_func(frame, result)
+            _, dst_img = vcap.resize_frame(dst_img)
+            img_draw.put_frame_pos(dst_img, frame_num, self.total_frame_num)
+            img_draw.put_message(dst_img, "'x' key to exit.", font_size=1.5, y=55)
+            with self.lock:
+                self.dst_img = dst_img
@@ -4,10 +4,12 @@ from tkinter import filedialog
 
 import pandas as pd
 
-from . import keypoints_proc, windows_and_mac
+from . import keypoints_proc, track_hdf, track_mmap, windows_and_mac
 
+TRACK_FILE_EXT = ".trk"
 
-def open_pkl(init_dir, org_path=None, filetypes=[("pkl files", "*.pkl")]):
+
+def open_pkl(init_dir, org_path=None, filetypes=[("Track files", "*.trk;*.pkl")]):
     if init_dir == "":
         init_dir = "~"
 
@@ -20,14 +22,93 @@ def open_pkl(init_dir, org_path=None, filetypes=[("pkl files", "*.pkl")]):
     return tar_path
 
 
-def load_track_file(tar_path, allow_calculated_track_file=False):
+def read_track_file(tar_path):
+    """
+    拡張子が.trkならHDF5、それ以外はpickleとして読み込む
+    """
+    if tar_path.endswith(TRACK_FILE_EXT):
+        return track_hdf.read_trk(tar_path)
+    return pd.read_pickle(tar_path)
+
+
+def find_track_file(tar_path):
+    """
+    tar_pathがあればそのまま返す
+    .pklがconvert_pkl_to_trk()で.trkに変換されていれば同じ名前の.trkを返す、どちらもなければNone
+    """
+    if os.path.exists(tar_path):
+        return tar_path
+    stem, ext = os.path.splitext(tar_path)
+    if ext == ".pkl" and os.path.exists(stem + TRACK_FILE_EXT):
+        return stem + TRACK_FILE_EXT
+    return None
+
+
+def read_track_attrs(tar_path):
+    """
+    attrsだけを読み込む、.trkならデータ本体は読み込まない
+    """
+    if tar_path.endswith(TRACK_FILE_EXT):
+        return track_hdf.read_trk_attrs(tar_path)
+    return pd.read_pickle(tar_path).attrs
+
+
+def write_track_file(tar_path, tar_df):
+    """
+    拡張子が.trkならHDF5、それ以外はpickleとして保存する
+    """
+    if tar_path.endswith(TRACK_FILE_EXT):
+        track_hdf.write_trk(tar_path, tar_df)
+    else:
+        tar_df.to_pickle(tar_path)
+
+
+def load_track_file(tar_path, allow_calculated_track_file=False, mmap=False, start_msec=None, end_msec=None, members=None, keypoints=None):
+    """
+    mmap=Trueの場合はtrk/mmapに保存した配列をメモリマップで開く
+    配列がない、またはTrack fileが更新されていたら一度だけ全体を読み込んで配列を作る
+    start_msec, end_msec, members, keypointsを指定すると該当する行だけを返す
+    .trkはディスクから該当するchunkだけを読み込み、.pklとmmapは読み込んだ後に絞り込む
+    """
     if os.path.exists(tar_path) is False:
         print(f"File not found: {tar_path}")
         return
-    src_df = pd.read_pickle(tar_path)
+    is_partial = any(v is not None for v in [start_msec, end_msec, members, keypoints])
+    if mmap is True and track_mmap.is_store_valid(tar_path) is True:
+        src_df = track_mmap.load_store(tar_path)
+        return _filter_track(src_df, start_msec, end_msec, members, keypoints) if is_partial else src_df
+    if mmap is False and is_partial is True and os.path.splitext(tar_path)[1] == TRACK_FILE_EXT:
+        where = track_hdf.make_where(tar_path, start_msec, end_msec, members, keypoints)
+        src_df = track_hdf.read_trk(tar_path, where=where)
+        is_partial = False
+    else:
+        src_df = read_track_file(tar_path)
     if keypoints_proc.has_keypoint(src_df) is False and allow_calculated_track_file is False:
         print(f"No keypoint index in {tar_path}")
         return
+    if mmap is True:
+        track_mmap.build_store(tar_path, src_df)
+        del src_df
+        src_df = track_mmap.load_store(tar_path)
+    if is_partial is True:
+        src_df = _filter_track(src_df, start_msec, end_msec, members, keypoints)
+    return src_df
+
+
+def _filter_track(src_df, start_msec, end_msec, members, keypoints):
+    """
+    メモリ上のTrackをload_track_file()の条件で絞り込む
+    """
+    if start_msec is not None or end_msec is not None:
+        start_msec = src_df["timestamp"].min() if start_msec is None else start_msec
+        end_msec = src_df["timestamp"].max() if end_msec is None else end_msec
+        src_df = keypoints_proc.filter_by_timerange(src_df, start_msec, end_msec)
+    if members is not None:
+        member_values = src_df.index.get_level_values("member").astype(str)
+        src_df = src_df.loc[member_values.isin([str(m) for m in members])]
+    if keypoints is not None:
+        keypoint_values = src_df.index.get_level_values("keypoint").astype(str)
+        src_df = src_df.loc[keypoint_values.isin([str(k) for k in keypoints])]
     return src_df
 
 
@@ -42,7 +123,7 @@ class PickleLoader:
         if filetype == "feat":
             self.filetypes = [("Feature files(HDF5)", "*.feat")]
         elif filetype == "pkl":
-            self.filetypes = [("Track files", "*.pkl;*.h5")]
+            self.filetypes = [("Track files", "*.trk;*.pkl;*.h5")]
         self.filetypes = windows_and_mac.file_types(self.filetypes)
 
         self.tar_path = org_path
@@ -84,7 +165,7 @@ def overwrite_track_file(tar_path, tar_df, not_found_ok=False):
     バックアップ先にファイルがあったら上書きする
     """
     if os.path.exists(tar_path) is False and not_found_ok is True:
-        tar_df.to_pickle(tar_path)
+        write_track_file(tar_path, tar_df)
         pkl_name = os.path.basename(tar_path)
         return pkl_name
 
@@ -97,7 +178,7 @@ def overwrite_track_file(tar_path, tar_df, not_found_ok=False):
     backup_path = os.path.join(backup_dir, os.path.basename(tar_path))
     # バックアップ先にファイルがあったら上書きする
     os.replace(tar_path, backup_path)
-    tar_df.to_pickle(tar_path)
+    write_track_file(tar_path, tar_df)
     pkl_name = os.path.basename(tar_path)
     return pkl_name
 
@@ -114,7 +195,7 @@ def save_pkl(org_pkl_path, dst_df, proc_history=None):
             dst_df.attrs["proc_history"].append(proc_history)
     file_name = filedialog.asksaveasfilename(
         title="Save as",
-        filetypes=[("pickle", ".pkl")],
+        filetypes=[("pickle", ".pkl"), ("Track file", TRACK_FILE_EXT)],
         initialdir=dst_dir,
         initialfile=file_name,
         defaultextension="pkl",
@@ -122,6 +203,32 @@ def save_pkl(org_pkl_path, dst_df, proc_history=None):
     if file_name == "":
         print("export() canceled.")
         return
-    dst_df.to_pickle(file_name)
+    write_track_file(file_name, dst_df)
     called_in = os.path.basename(inspect.stack()[1].filename)
     print(f"{called_in} > {os.path.basename(os.path.basename(file_name))}")
+
+
+def convert_pkl_to_trk(trk_dir):
+    """
+    trk_dirにある.pklのTrack fileを.trkに変換する
+    attrsのprev, nextも.trkのファイル名に書き換える
+    変換元の.pklはbackupフォルダに移動する
+    """
+    pkl_paths = [os.path.join(trk_dir, f) for f in os.listdir(trk_dir) if f.endswith(".pkl")]
+    pkl_names = [os.path.basename(p) for p in pkl_paths]
+    backup_dir = os.path.join(trk_dir, "backup")
+    trk_names = []
+    for pkl_path in pkl_paths:
+        src_df = pd.read_pickle(pkl_path)
+        if keypoints_proc.has_keypoint(src_df) is False:
+            print(f"No keypoint index in {pkl_path}")
+            continue
+        for key in ["prev", "next"]:
+            if key in src_df.attrs.keys() and src_df.attrs[key] in pkl_names:
+                src_df.attrs[key] = os.path.splitext(src_df.attrs[key])[0] + TRACK_FILE_EXT
+        trk_path = os.path.splitext(pkl_path)[0] + TRACK_FILE_EXT
+        track_hdf.write_trk(trk_path, src_df)
+        os.makedirs(backup_dir, exist_ok=True)
+        os.replace(pkl_path, os.path.join(backup_dir, os.path.basename(pkl_path)))
+        trk_names.append(os.path.basename(trk_path))
+    return trk_names
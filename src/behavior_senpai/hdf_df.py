@@ -111,8 +111,13 @@ class DataFrameStorage:
 
         with pd.HDFStore(self.filepath, mode="a") as store:
             if track_name != correct_track_name:
-                print(f"track_name mismatch: {track_name} != {correct_track_name}")
-                return
+                # .pklから.trkに変換したTrack fileなら同じファイルとして、profileを.trkの名前に書き換える
+                track_stem, track_ext = os.path.splitext(track_name)
+                correct_stem, correct_ext = os.path.splitext(correct_track_name)
+                if track_stem != correct_stem or correct_ext != ".pkl" or track_ext != ".trk":
+                    print(f"track_name mismatch: {track_name} != {correct_track_name}")
+                    return
+                store.put("profile", pd.DataFrame({"key": ["track_name"], "value": [track_name]}), format="table")
 
             store.put("mixnorm/df", src_df, format="table")
 
@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 
 
 def mosaic(src_img, center, size, dilate=10):
@@ -45,3 +46,14 @@ def draw_line(tar_img, start, end, color, thickness):
     if (start[0] == 0 and start[1] == 0) or (end[0] == 0 and end[1] == 0):
         return
     cv2.line(tar_img, start, end, color, thickness, cv2.LINE_AA)
+
+
+def draw_lines(tar_img, starts, ends, color, thickness):
+    """
+    startsとendsは(lines, 2)のint32配列、draw_lineと同じく(0, 0)を端に持つ線は描かずに1回のcv2.polylines()で描く
+    """
+    is_drawn = np.any(starts != 0, axis=1) & np.any(ends != 0, axis=1)
+    if not np.any(is_drawn):
+        return
+    segments = np.stack([starts[is_drawn], ends[is_drawn]], axis=1).astype(np.int32)
+    cv2.polylines(tar_img, list(segments), False, color, thickness, cv2.LINE_AA)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+# 最初に確保する行数、足りなくなったら2倍ずつ拡張する
+INIT_ROWS = 2**16
+
+
+class KeypointBuffer:
+    """
+    検出結果を1フレームずつ(members, keypoints, columns)の配列で受け取り、
+    事前に確保したNumPy配列に詰め込む
+    """
+
+    def __init__(self, columns, member_dtype=np.int64, init_rows=INIT_ROWS):
+        self.columns = columns
+        self.size = 0
+        self.frames = np.empty(init_rows, dtype=np.int64)
+        self.members = np.empty(init_rows, dtype=member_dtype)
+        self.keypoints = np.empty(init_rows, dtype=np.int64)
+        self.values = np.empty((init_rows, len(columns)), dtype=np.float64)
+        self.timestamps = np.empty(init_rows, dtype=np.float64)
+
+    def add(self, frame_num, member_ids, values, timestamp):
+        """
+        valuesは(members, keypoints, columns)の配列、member_idsはvaluesの1次元目に対応する
+        """
+        values = np.asarray(values, dtype=np.float64)
+        member_num, keypoint_num = values.shape[:2]
+        row_num = member_num * keypoint_num
+        if row_num == 0:
+            return
+        self._reserve(self.size + row_num)
+        s = slice(self.size, self.size + row_num)
+        self.frames[s] = frame_num
+        self.members[s] = np.repeat(np.asarray(member_ids, dtype=self.members.dtype), keypoint_num)
+        self.keypoints[s] = np.tile(np.arange(keypoint_num), member_num)
+        self.values[s] = values.reshape(row_num, len(self.columns))
+        self.timestamps[s] = timestamp
+        self.size += row_num
+
+    def to_dataframe(self):
+        """
+        詰め込んだ行だけをDataFrameにする、indexは(frame, member, keypoint)
+        """
+        s = slice(0, self.size)
+        index = pd.MultiIndex.from_arrays([self.frames[s], self.members[s], self.keypoints[s]], names=["frame", "member", "keypoint"])
+        dst_df = pd.DataFrame(self.values[s], index=index, columns=self.columns, copy=True)
+        dst_df["timestamp"] = self.timestamps[s]
+        return dst_df
+
+    def clear(self):
+        """
+        確保した配列は残したまま中身を空にする
+        """
+        self.size = 0
+
+    def _reserve(self, row_num):
+        capacity = len(self.frames)
+        if row_num <= capacity:
+            return
+        while capacity < row_num:
+            capacity *= 2
+        self.frames = np.resize(self.frames, capacity)
+        self.members = np.resize(self.members, capacity)
+        self.keypoints = np.resize(self.keypoints, capacity)
+        self.values = np.resize(self.values, (capacity, len(self.columns)))
+        self.timestamps = np.resize(self.timestamps, capacity)
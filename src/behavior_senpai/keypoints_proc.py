@@ -6,6 +6,8 @@ from sklearn.decomposition import PCA
 from sklearn.metrics.pairwise import pairwise_distances
 from umap import UMAP
 
+from behavior_senpai import kinematics
+
 
 def has_keypoint(src_df):
     """
@@ -30,26 +32,79 @@ def filter_by_timerange(src_df, start_msec: int, end_msec: int):
     return dst_df
 
 
+def interpolate_stride(src_df, stride: int, zero_point=(0, 0)):
+    """
+    strideフレームおきに検出したsrc_dfの間のフレームを線形補間で埋める
+    member, keypointごとに、間隔がstride以下の検出済みフレームの間だけを補間する(外挿はしない)
+    timestampを含むすべてのカラムを補間する
+    zero_point(ROIの左上)やNaNのkeypointは未検出として、未検出の行とつながる間は補間しない
+    検出した行はzero_pointも含めてそのまま残すので、strideなしで検出したときと同じ形式になる
+    """
+    if stride <= 1 or len(src_df) == 0:
+        return src_df
+    index_names = src_df.index.names
+    sorted_df = src_df.reset_index().sort_values(["member", "keypoint", "frame"], kind="stable")
+    frames = sorted_df["frame"].to_numpy()
+    same_kp = (sorted_df["member"].to_numpy()[1:] == sorted_df["member"].to_numpy()[:-1]) & (
+        sorted_df["keypoint"].to_numpy()[1:] == sorted_df["keypoint"].to_numpy()[:-1]
+    )
+    gaps = np.diff(frames)
+    x = sorted_df["x"].to_numpy(dtype=float)
+    y = sorted_df["y"].to_numpy(dtype=float)
+    is_missing = np.isnan(x) | np.isnan(y) | ((x == zero_point[0]) & (y == zero_point[1]))
+    is_fill = same_kp & (gaps > 1) & (gaps <= stride) & ~is_missing[:-1] & ~is_missing[1:]
+    starts = np.flatnonzero(is_fill)
+    if len(starts) == 0:
+        return src_df
+    fill_nums = gaps[starts] - 1
+    # 補間する行ごとに、元の行(start)と何フレーム先か(step)を求める
+    start_rows = np.repeat(starts, fill_nums)
+    steps = np.arange(fill_nums.sum()) - np.repeat(np.cumsum(fill_nums) - fill_nums, fill_nums) + 1
+    ratio = (steps / np.repeat(gaps[starts], fill_nums))[:, np.newaxis]
+
+    value_cols = [c for c in src_df.columns if np.issubdtype(src_df[c].dtype, np.number)]
+    values = sorted_df[value_cols].to_numpy(dtype=float)
+    fill_values = values[start_rows] + (values[start_rows + 1] - values[start_rows]) * ratio
+    fill_df = pd.DataFrame(fill_values, columns=value_cols)
+    fill_df["frame"] = frames[start_rows] + steps
+    fill_df["member"] = sorted_df["member"].to_numpy()[start_rows]
+    fill_df["keypoint"] = sorted_df["keypoint"].to_numpy()[start_rows]
+    fill_df = fill_df.set_index(index_names).astype(src_df[value_cols].dtypes.to_dict())
+
+    dst_df = pd.concat([src_df, fill_df]).sort_index(level=0, sort_remaining=False, kind="stable")
+    dst_df.attrs = src_df.attrs
+    return dst_df
+
+
 def zero_point_to_nan(src_df):
+    """
+    ROIの左上(ROIなしなら(0, 0))にあるkeypointは未検出なのでx, yをNaNにする、src_dfをそのまま書き換える
+    x, yが1つも残らなかったmemberは削除する
+    """
     if "roi_left_top" in src_df.attrs:
         zero_point = src_df.attrs["roi_left_top"]
     else:
         zero_point = (0, 0)
     left, top = zero_point
 
-    src_df.loc[(src_df["x"] == left) & (src_df["y"] == top), ["x", "y"]] = [np.nan, np.nan]
-
-    members = src_df.index.get_level_values("member").unique().tolist()
-    gohst_members = []
-    for member in members:
-        sliced_df = src_df.loc[pd.IndexSlice[:, member, :], :]
-        sliced_df = sliced_df.loc[~(sliced_df["x"].isna()) & (~sliced_df["y"].isna())]
-        if len(sliced_df.index.get_level_values(0).unique()) == 0:
-            gohst_members.append(member)
-
-    if len(gohst_members) > 0:
-        print(f"{len(gohst_members)} members has no data")
-        src_df = src_df.drop(gohst_members, level=1)
+    x = src_df["x"].to_numpy()
+    y = src_df["y"].to_numpy()
+    is_zero = (x == left) & (y == top)
+    if np.any(is_zero):
+        src_df.loc[is_zero, ["x", "y"]] = np.nan
+    is_valid = ~(is_zero | np.isnan(x) | np.isnan(y))
+
+    # memberのcodeごとに有効なkeypointの数を数える
+    member_pos = src_df.index.names.index("member")
+    member_codes = src_df.index.codes[member_pos]
+    member_num = len(src_df.index.levels[member_pos])
+    valid_counts = np.bincount(member_codes[is_valid], minlength=member_num)
+    row_counts = np.bincount(member_codes, minlength=member_num)
+    is_gohst = (row_counts > 0) & (valid_counts == 0)
+
+    if np.any(is_gohst):
+        print(f"{np.count_nonzero(is_gohst)} members has no data")
+        src_df = src_df.loc[~is_gohst[member_codes], :]
 
     return src_df
 
@@ -61,32 +116,37 @@ def calc_speed(src_df, step_frame: int):
     dx = x(t) - x(t - step_frame)
     dy = y(t) - y(t - step_frame)
     """
-    diff_df = src_df.groupby(level=["member", "keypoint"]).diff(step_frame) ** 2
-    speed_df = pd.DataFrame(np.sqrt(diff_df["x"] + diff_df["y"]) / step_frame, columns=[f"spd_{step_frame}"])
-    return speed_df
+    return kinematics.Kinematics(src_df).to_dataframe([step_frame])
+
+
+def calc_acceleration(src_df, step_frame: int):
+    """
+    src_dfの各keypointの加速度を計算する
+    acceleration = (speed(t) - speed(t - step_frame)) / step_frame
+    """
+    return kinematics.Kinematics(src_df).to_dataframe([step_frame], kinds=("acc",))
 
 
-def calc_acceleration(speed_df, step_frame: int):
+def calc_jerk(src_df, step_frame: int):
     """
-    speed_dfの各keypointの加速度を計算する
+    src_dfの各keypointの躍度を計算する
+    jerk = (acceleration(t) - acceleration(t - step_frame)) / step_frame
     """
-    diff_df = speed_df.groupby(level=["member", "keypoint"]).diff(step_frame)
-    acc_df = pd.DataFrame(diff_df[f"spd_{step_frame}"] / step_frame).rename(columns={f"spd_{step_frame}": f"acc_{step_frame}"})
-    return acc_df
+    return kinematics.Kinematics(src_df).to_dataframe([step_frame], kinds=("jrk",))
 
 
 def calc_total_distance(src_df, step_frame: int, per_plot=False):
     """
     src_dfの各keypointの総移動距離を計算する
     """
-    diff_df = src_df.groupby(level=["member", "keypoint"]).diff(step_frame) ** 2
-    total_distance_df = pd.DataFrame(np.sqrt(diff_df["x"] + diff_df["y"]).groupby(level=["member", "keypoint"]).sum(), columns=["total_distance"])
+    total_distance_df = kinematics.Kinematics(src_df).path_length(step_frame).sort_index()
     if per_plot:
-        plot_count_df = src_df.groupby(level=["member", "keypoint"]).size().to_frame("plot_count")
-        total_distance_df = pd.concat([total_distance_df, plot_count_df], axis=1)
         total_distance_df["total_distance_per_plot"] = total_distance_df["total_distance"] / total_distance_df["plot_count"]
+    else:
+        total_distance_df = total_distance_df.drop(columns="plot_count")
     return total_distance_df
 
+
 def thinning(src_df, thinning: int):
     """
     thinningの値だけsrc_dfのframeを間引く
@@ -144,30 +204,45 @@ def calc_recurrence(src_arr, threshold: float):
     return dst_mat
 
 
+def points_in_polygon(x, y, poly):
+    """
+    x, yの点がpolyの内側にあればTrue、凸でない多角形にも使えるようにeven-odd rule(ray casting)で判定する
+    点から右に伸ばした半直線が辺と交わるたびに内外を反転する、x, yがNaNの点はFalse
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    poly = np.asarray(poly, dtype=float)
+    inside = np.zeros(x.shape, dtype=bool)
+    # 辺ごとにすべての点をまとめて判定する、点×辺の配列は作らない
+    for (x_from, y_from), (x_to, y_to) in zip(np.roll(poly, 1, axis=0), poly, strict=True):
+        # 水平な辺とは交わらない
+        if y_from == y_to:
+            continue
+        crosses = (y_from > y) != (y_to > y)
+        x_cross = x_from + (y - y_from) * (x_to - x_from) / (y_to - y_from)
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def is_in_areas(src_df, areas: dict, scale=1.0):
+    """
+    areasは{area_name: poly_points}、area_nameごとにsrc_dfのx, yがpoly_pointsの内側ならTrueの列を返す
+    poly_pointsは画面上の座標なのでscaleで割って動画の座標に戻す
+    """
+    x = src_df["x"].to_numpy(dtype=float)
+    y = src_df["y"].to_numpy(dtype=float)
+    isin_dict = {}
+    for area_name, poly_points in areas.items():
+        poly = np.trunc(np.asarray(poly_points, dtype=float) / scale)
+        isin_dict[area_name] = points_in_polygon(x, y, poly)
+    return pd.DataFrame(isin_dict, index=src_df.index)
+
+
 def is_in_poly(src_df, poly_points, area_name, scale=1.0):
     """
     poly_pointsの内側にtarget_keypointがあったらTrue
     """
-    tar_point = src_df
-    in_out_df = pd.DataFrame()
-    for i, point in enumerate(poly_points):
-        vect_df = tar_point.copy()
-        x_to = int(point[0] / scale)
-        y_to = int(point[1] / scale)
-        x_from = int(poly_points[i - 1][0] / scale)
-        y_from = int(poly_points[i - 1][1] / scale)
-        anchor_vector = np.array([x_to - x_from, y_to - y_from])
-        vect_df["x"] = tar_point["x"] - x_from
-        vect_df["y"] = tar_point["y"] - y_from
-        cross_sr = anchor_vector[0] * vect_df["y"] - anchor_vector[1] * vect_df["x"]
-        cross_sr = cross_sr < 0
-        cross_df = cross_sr.to_frame()
-        cross_df.columns = [i]
-        in_out_df = pd.concat([in_out_df, cross_df], axis=1)
-    # 全てのcolumnsがTrueならTrue
-    isin_df = in_out_df.all(axis=1).to_frame()
-    isin_df.columns = [area_name]
-    return isin_df
+    return is_in_areas(src_df, {area_name: poly_points}, scale)
 
 
 def remove_by_bool_col(src_df, bool_col_name: str, drop_member: bool = False):
@@ -362,6 +437,116 @@ def calc_cross_dot_plus_norms(src_df, kp0: int, kp1: int, kp2: int):
     return dst_df
 
 
+def get_points_col_names(code: str, kp0: int, kp1: int, kp2: int = None):
+    """
+    calc_points()が作るカラム名、calc_norm()などと同じ名前にする
+    """
+    ab = f"{kp0}-{kp1}"
+    ab_ac = f"{kp0}-{kp1},{kp0}-{kp2}"
+    col_names = {
+        "norm": [f"norm({ab})"],
+        "direction": [f"sin({ab})", f"cos({ab})"],
+        "component": [f"component_x({ab})", f"component_y({ab})"],
+        "sin_cos": [f"sin({ab_ac})", f"cos({ab_ac})"],
+        "cross": [f"cross({ab_ac})"],
+        "dot": [f"dot({ab_ac})"],
+        "plus": [f"plus_x({ab_ac})", f"plus_y({ab_ac})"],
+        "norms": [f"norms({ab_ac})"],
+        "angle": [f"angle({ab_ac})"],
+    }
+    return col_names[code]
+
+
+def pivot_points(src_df):
+    """
+    (frame, member, keypoint)のx, yを(frame×member, keypoint, xy)の配列に1回だけ並べ替える
+    (frame, member)のindex、keypoint→位置のdict、(frame, member)ごとのtimestampも返す
+    """
+    idx = src_df.index
+    frame_pos, member_pos, keypoint_pos = [idx.names.index(name) for name in ["frame", "member", "keypoint"]]
+    member_levels = idx.levels[member_pos]
+    keypoint_levels = idx.levels[keypoint_pos]
+    # (frame, member)の組み合わせごとに1行にする
+    fm_keys = idx.codes[frame_pos].astype(np.int64) * len(member_levels) + idx.codes[member_pos]
+    row_keys, row_codes = np.unique(fm_keys, return_inverse=True)
+    fm_index = pd.MultiIndex.from_arrays(
+        [idx.levels[frame_pos][row_keys // len(member_levels)], member_levels[row_keys % len(member_levels)]], names=["frame", "member"]
+    )
+    keypoint_codes = idx.codes[keypoint_pos]
+    keypoint_dict = {kp: i for i, kp in enumerate(keypoint_levels.tolist())}
+
+    points = np.full((len(fm_index), len(keypoint_levels), 2), np.nan)
+    points[row_codes, keypoint_codes] = src_df.loc[:, ["x", "y"]].to_numpy(dtype=float)
+    timestamps = np.full(len(fm_index), np.nan)
+    if "timestamp" in src_df.columns:
+        timestamps[row_codes] = src_df["timestamp"].to_numpy(dtype=float)
+    return points, fm_index, keypoint_dict, timestamps
+
+
+def calc_points(src_df, specs: list):
+    """
+    specsは[(code, member, kp0, kp1, kp2), ...]、kp2は2点の計算では使わない
+    src_dfを1回だけpivot_points()で配列にして、すべての計算をまとめて行う
+    indexは(frame, member)、specsに含まれるmemberの行だけを返す、最後の列はtimestamp
+    """
+    points, fm_index, keypoint_dict, timestamps = pivot_points(src_df)
+    members = fm_index.get_level_values("member")
+    member_rows = {}
+    features = {}
+    for code, member, kp0, kp1, kp2 in specs:
+        if member not in member_rows:
+            member_rows[member] = np.flatnonzero(members == member)
+        rows = member_rows[member]
+        col_names = get_points_col_names(code, kp0, kp1, kp2)
+        values = _calc_points_values(code, points[rows], keypoint_dict, kp0, kp1, kp2)
+        for col_name, value in zip(col_names, values, strict=True):
+            if col_name not in features:
+                features[col_name] = np.full(len(fm_index), np.nan)
+            features[col_name][rows] = value
+
+    if len(member_rows) == 0:
+        return pd.DataFrame(columns=["timestamp"], index=fm_index[:0])
+    tar_rows = np.sort(np.concatenate(list(member_rows.values())))
+    dst_df = pd.DataFrame({col_name: value[tar_rows] for col_name, value in features.items()}, index=fm_index[tar_rows])
+    dst_df["timestamp"] = timestamps[tar_rows]
+    return dst_df
+
+
+def _calc_points_values(code, points, keypoint_dict, kp0, kp1, kp2):
+    def get_point(kp):
+        if kp not in keypoint_dict:
+            return np.full((len(points), 2), np.nan)
+        return points[:, keypoint_dict[kp]]
+
+    point0 = get_point(kp0)
+    point1_0 = get_point(kp1) - point0
+    norm1 = np.sqrt(point1_0[:, 0] ** 2 + point1_0[:, 1] ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if code == "norm":
+            return [norm1]
+        elif code == "direction":
+            return [point1_0[:, 1] / norm1, point1_0[:, 0] / norm1]
+        elif code == "component":
+            return [point1_0[:, 0], point1_0[:, 1]]
+
+        point2_0 = get_point(kp2) - point0
+        norms = norm1 * np.sqrt(point2_0[:, 0] ** 2 + point2_0[:, 1] ** 2)
+        cross = point1_0[:, 0] * point2_0[:, 1] - point1_0[:, 1] * point2_0[:, 0]
+        dot = point1_0[:, 0] * point2_0[:, 0] + point1_0[:, 1] * point2_0[:, 1]
+        if code == "sin_cos":
+            return [cross / norms, dot / norms]
+        elif code == "cross":
+            return [cross]
+        elif code == "dot":
+            return [dot]
+        elif code == "plus":
+            return [point1_0[:, 0] + point2_0[:, 0], point1_0[:, 1] + point2_0[:, 1]]
+        elif code == "norms":
+            return [norms]
+        elif code == "angle":
+            return [np.arccos(dot / norms)]
+
+
 def calc_moving_average(src_df, window_size: int):
     """
     timestamp以外の全てのカラムを移動平均する
@@ -411,11 +596,12 @@ if __name__ == "__main__":
     #    test_df.attrs['frame_size'] = (500, 500)
     #    test_df.to_pickle('test.pkl')
 
-    # calc_speed, calc_acceleration
+    # calc_speed, calc_acceleration, calc_jerk
     dt_span = 10
     speed_df = calc_speed(test_df, dt_span)
-    acc_df = calc_acceleration(speed_df, dt_span)
-    test_speed_df = pd.concat([test_df, speed_df, acc_df], axis=1)
+    acc_df = calc_acceleration(test_df, dt_span)
+    jerk_df = calc_jerk(test_df, dt_span)
+    test_speed_df = pd.concat([test_df, speed_df, acc_df, jerk_df], axis=1)
 
     # thinning
     thinning_val = 140
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+
+class Kinematics:
+    """
+    Trackを(member, keypoint)ごとに連続した配列に並べ替えて、速さ、加速度、躍度、移動距離を計算する
+    差分はgroupby(level=["member", "keypoint"]).diff(step)と同じく、同じmember, keypointの中で行を遡る
+    計算した結果はstepごとにキャッシュする
+    """
+
+    def __init__(self, src_df):
+        self.index = src_df.index
+        idx = self.index
+        member_pos, keypoint_pos = idx.names.index("member"), idx.names.index("keypoint")
+        member_codes, self.members = idx.codes[member_pos], idx.levels[member_pos]
+        keypoint_codes, self.keypoints = idx.codes[keypoint_pos], idx.levels[keypoint_pos]
+        group_codes = member_codes.astype(np.int64) * len(self.keypoints) + keypoint_codes
+        # 同じグループの中では元の行の順番を保つ
+        self.order = np.argsort(group_codes, kind="stable")
+        self.group_codes = group_codes[self.order]
+        self.x = src_df["x"].to_numpy(dtype=float)[self.order]
+        self.y = src_df["y"].to_numpy(dtype=float)[self.order]
+        self.cache = {}
+
+    def speed(self, step: int):
+        """
+        speed = sqrt(dx^2 + dy^2) / step
+        """
+        return self._cached("spd", step, lambda: self._distance(step) / step)
+
+    def acceleration(self, step: int):
+        return self._cached("acc", step, lambda: self._diff(self.speed(step), step) / step)
+
+    def jerk(self, step: int):
+        return self._cached("jrk", step, lambda: self._diff(self.acceleration(step), step) / step)
+
+    def path_length(self, step: int):
+        """
+        (member, keypoint)ごとのstep間隔の移動距離の合計、NaNは飛ばす
+        """
+        distance = self._distance(step)
+        is_valid = ~np.isnan(distance)
+        group_num = len(self.members) * len(self.keypoints)
+        total = np.bincount(self.group_codes[is_valid], weights=distance[is_valid], minlength=group_num)
+        plot_count = np.bincount(self.group_codes, minlength=group_num)
+        index = pd.MultiIndex.from_product([self.members, self.keypoints], names=["member", "keypoint"])
+        dst_df = pd.DataFrame({"total_distance": total, "plot_count": plot_count}, index=index)
+        # 存在しない(member, keypoint)の組み合わせは除く
+        return dst_df.loc[dst_df["plot_count"] > 0, :]
+
+    def to_dataframe(self, steps: list, kinds=("spd",)):
+        """
+        stepsのそれぞれについてkindsの列を持つDataFrameを元のindexの順番で返す
+        kindsは"spd", "acc", "jrk"、列名はspd_10のようにする
+        """
+        funcs = {"spd": self.speed, "acc": self.acceleration, "jrk": self.jerk}
+        columns = {}
+        for step in steps:
+            for kind in kinds:
+                values = np.empty(len(self.order))
+                values[self.order] = funcs[kind](step)
+                columns[f"{kind}_{step}"] = values
+        return pd.DataFrame(columns, index=self.index)
+
+    def _cached(self, kind, step, func):
+        key = (kind, step)
+        if key not in self.cache:
+            self.cache[key] = func()
+        return self.cache[key]
+
+    def _distance(self, step):
+        return self._cached("dist", step, lambda: np.sqrt(self._diff(self.x, step) ** 2 + self._diff(self.y, step) ** 2))
+
+    def _diff(self, values, step):
+        # step行前が別のmember, keypointならNaN
+        dst = np.full(len(values), np.nan)
+        if step <= 0 or step >= len(values):
+            return dst
+        same_group = self.group_codes[step:] == self.group_codes[:-step]
+        dst[step:] = np.where(same_group, values[step:] - values[:-step], np.nan)
+        return dst
@@ -1,17 +1,20 @@
 import cv2
 import mediapipe as mp
-import pandas as pd
+import numpy as np
 
-from behavior_senpai import img_draw, vcap
+from behavior_senpai import detect_pipeline, keypoint_buffer
 
 
 class MediaPipeDetector:
-    def __init__(self, show=True):
+    def __init__(self, show=True, stride=1):
         self.mph = mp.solutions.holistic
         self.model = self.mph.Holistic(model_complexity=2, refine_face_landmarks=True)
 
         self.number_of_keypoints = {"face": 478, "right_hand": 21, "left_hand": 21, "pose": 33}
         self.show = show
+        # 何フレームおきに検出するか
+        self.stride = stride
+        self.checkpoint = None
         if self.show is True:
             self.drawing = mp.solutions.drawing_utils
 
@@ -21,63 +24,65 @@ class MediaPipeDetector:
         self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
+    def set_checkpoint(self, checkpoint):
+        """
+        途中結果を書き出すCheckpoint、前回の続きのフレームから検出を再開する
+        """
+        self.checkpoint = checkpoint
+
     def detect(self, roi=False):
         # データの初期化
-        data_dict = {"frame": [], "member": [], "keypoint": [], "x": [], "y": [], "z": [], "timestamp": []}
-        for i in range(self.total_frame_num):
-            if roi is True:
-                ret, frame = self.cap.get_roi_frame()
-            else:
-                ret, frame = self.cap.read()
-            if ret is False:
-                print("Failed to read frame.")
-                continue
-            rgb_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = self.model.process(rgb_img)
-            timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC)
-
-            # 検出結果を描画、xキーで途中終了
-            if self.show is True:
-                self._draw(frame, results)
-                _, frame = vcap.resize_frame(frame)
-                img_draw.put_frame_pos(frame, i, self.total_frame_num)
-                img_draw.put_message(frame, "'x' key to exit.", font_size=1.5, y=55)
-                cv2.imshow("dst", frame)
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord("x"):
-                    break
+        buffer = keypoint_buffer.KeypointBuffer(["x", "y", "z"], member_dtype=object)
+        # デコードと描画は別スレッド、推論はこのスレッドで行う
+        # Holisticは前フレームの結果を使って追跡するので1フレームずつ推論する
+        start_frame = 0
+        if self.checkpoint is not None:
+            start_frame = self.checkpoint.get_start_frame()
+        reader = detect_pipeline.FrameReader(self.cap, self.total_frame_num, start_frame=start_frame, stride=self.stride)
+        preview = None
+        if self.show is True:
+            preview = detect_pipeline.PreviewRenderer(self._draw, self.total_frame_num)
+        try:
+            for batch in reader.batches(1):
+                i, frame, timestamp = batch[0]
+                rgb_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                results = self.model.process(rgb_img)
 
-            # 検出結果の取り出し
-            member_ids = ["face", "right_hand", "left_hand", "pose"]
-            for member_id in member_ids:
-                landmarks = getattr(results, f"{member_id}_landmarks")
-                if landmarks is None:
-                    continue
-                keypoints = landmarks.landmark
+                # 検出結果を表示、xキーで途中終了
+                if preview is not None:
+                    preview.put(i, frame, results)
+                    if preview.show() is True:
+                        break
 
-                for k in range(self.number_of_keypoints[member_id]):
-                    keypoint_id = k
+                # 検出結果の取り出し、memberごとにkeypoint数が違うので(1, keypoints, 3)の配列で詰め込む
+                member_ids = ["face", "right_hand", "left_hand", "pose"]
+                for member_id in member_ids:
+                    landmarks = getattr(results, f"{member_id}_landmarks")
+                    if landmarks is None:
+                        continue
+                    keypoints = landmarks.landmark[: self.number_of_keypoints[member_id]]
+                    result_keypoints = np.array([[kp.x, kp.y, kp.z] for kp in keypoints])
                     if roi is True:
-                        x = float(keypoints[k].x * self.cap.roi_width + self.cap.left_top_point[0])
-                        y = float(keypoints[k].y * self.cap.roi_height + self.cap.left_top_point[1])
-                        z = float(keypoints[k].z * self.cap.roi_width)
+                        result_keypoints *= [self.cap.roi_width, self.cap.roi_height, self.cap.roi_width]
+                        result_keypoints[:, :2] += self.cap.left_top_point
                     else:
-                        x = float(keypoints[k].x * self.frame_width)
-                        y = float(keypoints[k].y * self.frame_height)
-                        z = float(keypoints[k].z * self.frame_width)
-
-                    # データの詰め込み
-                    data_dict["frame"].append(i)
-                    data_dict["member"].append(member_id)
-                    data_dict["keypoint"].append(keypoint_id)
-                    data_dict["x"].append(x)
-                    data_dict["y"].append(y)
-                    data_dict["z"].append(z)
-                    data_dict["timestamp"].append(timestamp)
+                        result_keypoints *= [self.frame_width, self.frame_height, self.frame_width]
+                    buffer.add(i, [member_id], result_keypoints[np.newaxis], timestamp)
+                if self.checkpoint is not None:
+                    self.checkpoint.update(buffer, i)
+        finally:
+            # 例外で抜けても読み込みと描画のスレッドを残さない
+            reader.stop()
+            if preview is not None:
+                preview.stop()
+        self.completed = reader.finished
 
         # keypointはここではintで保持する、indexでソートしたくなるかもしれないので
-        self.dst_df = pd.DataFrame(data_dict).set_index(["frame", "member", "keypoint"])
-        cv2.destroyAllWindows()
+        if self.checkpoint is not None:
+            self.checkpoint.update(buffer, self.checkpoint.last_frame, force=True)
+            self.dst_df = self.checkpoint.load(buffer)
+        else:
+            self.dst_df = buffer.to_dataframe()
 
     def get_result(self):
         return self.dst_df
@@ -111,3 +116,4 @@ class MediaPipeDetector:
             self.drawing.DrawingSpec(color=(50, 50, 250), thickness=1, circle_radius=1),
             self.drawing.DrawingSpec(color=(180, 180, 180), thickness=1, circle_radius=1),
         )
+        return anno_img
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from behavior_senpai import time_format
+
+
+def summarize_members(member_table, members=None):
+    """
+    memberごとに、x, yがNaNでない行の最初と最後のtimestamp、その間の長さ、1フレームあたりのkeypoint数を1回の集計で求める
+    membersを指定するとそのmemberの行だけを集計する、有効な行がないmemberは結果に含まれない
+    """
+    is_valid = member_table.is_valid & ~member_table.removed
+    if members is not None:
+        tar_codes = [member_table.label_codes[member] for member in members if member in member_table.label_codes]
+        is_valid &= np.isin(member_table.member_codes, tar_codes)
+
+    valid_df = pd.DataFrame(
+        {
+            "member": member_table.member_codes[is_valid],
+            "frame": member_table.frame_codes[is_valid],
+            "timestamp": member_table.timestamps[is_valid],
+        }
+    )
+    summary_df = valid_df.groupby("member").agg(
+        start=("timestamp", "first"), end=("timestamp", "last"), rows=("frame", "size"), frames=("frame", "nunique")
+    )
+    summary_df.index = pd.Index(np.array(member_table.labels, dtype=object)[summary_df.index], name="member")
+    summary_df["duration"] = summary_df["end"] - summary_df["start"]
+    summary_df["kpf"] = summary_df["rows"] / summary_df["frames"]
+    return summary_df
+
+
+class MemberSummary:
+    """
+    Member Editの一覧に出すmemberごとの集計をキャッシュする
+    renameやremoveで変わったmemberだけを集計し直す
+    """
+
+    def __init__(self, member_table):
+        self.summary_df = summarize_members(member_table)
+
+    def update(self, member_table, members):
+        """
+        membersの集計だけをmember_tableから求め直す、行がなくなったmemberは一覧から消える
+        """
+        members = [str(member) for member in members]
+        update_df = summarize_members(member_table, members)
+        summary_df = self.summary_df.drop(members, errors="ignore")
+        self.summary_df = pd.concat([summary_df, update_df])
+
+    def copy(self):
+        dst = MemberSummary.__new__(MemberSummary)
+        dst.summary_df = self.summary_df.copy()
+        return dst
+
+    def get_tree_rows(self):
+        """
+        開始時刻順に[member, start, end, duration, keypoints/frame]のリストを返す
+        """
+        summary_df = self.summary_df.sort_values(["start", "end"], kind="stable")
+        rows = []
+        for member, row in summary_df.iterrows():
+            rows.append(
+                [
+                    member,
+                    time_format.msec_to_timestr_with_fff(row["start"]),
+                    time_format.msec_to_timestr_with_fff(row["end"]),
+                    time_format.msec_to_timestr_with_fff(row["duration"]),
+                    f"{row['kpf']:.2f}",
+                ]
+            )
+        return rows
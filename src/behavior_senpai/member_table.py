@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+class MemberTable:
+    """
+    Trackの行ごとのmemberを整数のコードで持ち、コードとmember名の対応表を別に持つ
+    renameは対応表の書き換えかコードの付け替え、removeは削除マスクを立てるだけで、DataFrameは作り直さない
+    to_dataframe()で削除した行を詰めて、member名を反映したDataFrameを作る
+    """
+
+    def __init__(self, src_df):
+        self.src_df = src_df
+        idx = src_df.index
+        self.frame_pos, self.member_pos, self.keypoint_pos = [idx.names.index(name) for name in ["frame", "member", "keypoint"]]
+        # 1と"1"のように文字列にすると同じになるmemberは1つのコードにまとめる
+        level_codes, labels = pd.factorize(idx.levels[self.member_pos].astype(str))
+        self.member_codes = level_codes[idx.codes[self.member_pos]].astype(np.int32)
+        self.labels = labels.tolist()
+        self.label_codes = {label: code for code, label in enumerate(self.labels)}
+        self.frame_codes = idx.codes[self.frame_pos]
+        self.keypoint_codes = idx.codes[self.keypoint_pos]
+        self.timestamps = src_df["timestamp"].to_numpy(dtype=float)
+        self.is_valid = ~(np.isnan(src_df["x"].to_numpy(dtype=float)) | np.isnan(src_df["y"].to_numpy(dtype=float)))
+        self.removed = np.zeros(len(src_df), dtype=bool)
+
+    def get_members(self):
+        """
+        削除されていない行があるmember名のリスト
+        """
+        codes = np.unique(self.member_codes[~self.removed])
+        return [self.labels[code] for code in codes]
+
+    def rename(self, old_member: str, new_member: str, start_msec, end_msec):
+        """
+        old_memberの[start_msec, end_msec]の行をnew_memberに変える
+        同じframe, keypointの行がnew_memberにすでにあれば、元の行の順番で後ろの行を残す
+        """
+        old_code = self.label_codes.get(old_member)
+        if old_code is None or old_member == new_member:
+            return
+        is_member = (self.member_codes == old_code) & ~self.removed
+        rename_mask = is_member & self._between(start_msec, end_msec)
+        if not rename_mask.any():
+            return
+
+        new_code = self.label_codes.get(new_member)
+        if new_code is None and np.array_equal(rename_mask, is_member):
+            # member全体を新しい名前にするときは対応表を書き換えるだけ
+            self.labels[old_code] = new_member
+            del self.label_codes[old_member]
+            self.label_codes[new_member] = old_code
+            return
+        if new_code is None:
+            new_code = len(self.labels)
+            self.labels.append(new_member)
+            self.label_codes[new_member] = new_code
+        self.member_codes[rename_mask] = new_code
+        self._remove_duplicates([new_code])
+
+    def rename_members(self, mapping: dict):
+        """
+        {元のmember: 新しいmember}の対応でmember全体をまとめてrenameする
+        """
+        old_codes, new_codes = [], []
+        for old_member, new_member in mapping.items():
+            old_code = self.label_codes.get(old_member)
+            if old_code is None or old_member == new_member:
+                continue
+            if new_member not in self.label_codes:
+                self.label_codes[new_member] = len(self.labels)
+                self.labels.append(new_member)
+            old_codes.append(old_code)
+            new_codes.append(self.label_codes[new_member])
+        if len(new_codes) == 0:
+            return
+        code_map = np.arange(len(self.labels), dtype=np.int32)
+        code_map[old_codes] = new_codes
+        self.member_codes = code_map[self.member_codes]
+        self._remove_duplicates(new_codes)
+
+    def remove(self, member: str, start_msec=None, end_msec=None):
+        """
+        memberの行に削除マスクを立てる、start_msec, end_msecを指定するとその間の行だけ
+        """
+        code = self.label_codes.get(member)
+        if code is None:
+            return
+        remove_mask = self.member_codes == code
+        if start_msec is not None and end_msec is not None:
+            remove_mask &= self._between(start_msec, end_msec)
+        self.removed |= remove_mask
+
+    def get_member_df(self, member: str):
+        """
+        memberの削除されていない行だけを取り出す
+        """
+        code = self.label_codes.get(member)
+        if code is None:
+            return self.src_df.iloc[:0]
+        rows = np.flatnonzero((self.member_codes == code) & ~self.removed)
+        return self._build(rows, np.zeros(len(rows), dtype=np.int32), pd.Index([member]))
+
+    def to_dataframe(self):
+        """
+        削除した行を詰めて、memberを文字列にしたDataFrameを作る
+        """
+        rows = np.flatnonzero(~self.removed)
+        # memberのlevelは名前順に並べる
+        order = np.argsort(np.array(self.labels, dtype=object), kind="stable")
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        member_level = pd.Index(np.array(self.labels, dtype=object)[order])
+        return self._build(rows, rank[self.member_codes[rows]], member_level)
+
+    def _build(self, rows, member_codes, member_level):
+        idx = self.src_df.index
+        levels = list(idx.levels)
+        levels[self.member_pos] = member_level
+        codes = [level_codes[rows] for level_codes in idx.codes]
+        codes[self.member_pos] = member_codes
+        dst_df = self.src_df.iloc[rows]
+        dst_df.index = pd.MultiIndex(levels=levels, codes=codes, names=idx.names).remove_unused_levels()
+        return dst_df
+
+    def _between(self, start_msec, end_msec):
+        # Series.between(start_msec - 1, end_msec + 1)と同じ範囲
+        return (self.timestamps >= start_msec - 1) & (self.timestamps <= end_msec + 1)
+
+    def _remove_duplicates(self, codes):
+        rows = np.flatnonzero(np.isin(self.member_codes, codes) & ~self.removed)
+        keys = self.member_codes[rows].astype(np.int64) * len(self.src_df.index.levels[self.frame_pos]) + self.frame_codes[rows]
+        keys = keys * len(self.src_df.index.levels[self.keypoint_pos]) + self.keypoint_codes[rows]
+        self.removed[rows[pd.Index(keys).duplicated(keep="last")]] = True
@@ -1,3 +1,4 @@
+import functools
 import os
 import random
 import tomllib
@@ -10,32 +11,59 @@ from behavior_senpai import img_draw
 from gui_parts import TempFile
 
 
+class Skeleton:
+    """
+    keypointのtomlを配列にしたもの、tomlのkeypointの並び順を位置として使う
+    """
+
+    def __init__(self, data):
+        names = list(data["keypoints"].keys())
+        positions = {name: i for i, name in enumerate(names)}
+        self.names = names
+        self.ids = np.array([val["id"] for val in data["keypoints"].values()], dtype=np.intp)
+        self.colors = [tuple(val["color"]) for val in data["keypoints"].values()]
+        self.bones = np.array([[positions[a], positions[b]] for a, b in data["bones"]["bones"]], dtype=np.intp).reshape(-1, 2)
+        self.labels = np.array([positions[name] for name in data["draw"]["labels"]], dtype=np.intp)
+        self.mask = np.array([positions[name] for name in data["draw"]["mask"]], dtype=np.intp)
+        self.threshold = data["bones"]["threshold"]
+
+
+@functools.lru_cache(maxsize=None)
+def load_skeleton(kp_toml_name):
+    """
+    tomlはファイルごとに1回だけ読み込む
+    """
+    toml_path = os.path.join(os.path.dirname(__file__), "..", "keypoint", kp_toml_name)
+    with open(toml_path, "rb") as f:
+        data = tomllib.load(f)
+    return Skeleton(data)
+
+
 class Annotate:
-    def __init__(self, kp_toml_name=None):
-        temp = TempFile()
-        self.draw_mask = temp.get_draw_mask()
-        toml_path = os.path.join(os.path.dirname(__file__), "..", "keypoint", kp_toml_name)
-        with open(toml_path, "rb") as f:
-            self.data = tomllib.load(f)
+    def __init__(self, kp_toml_name=None, draw_mask=None):
+        if draw_mask is None:
+            draw_mask = TempFile().get_draw_mask()
+        self.draw_mask = draw_mask
+        self.skeleton = load_skeleton(kp_toml_name)
 
     def set_pose(self, kps):
-        self.keypoints = {}
-        self.keypoint_colors = {}
-        self.keypoint_scores = {}
-        self.bones = self.data["bones"]["bones"]
-        for key, val in self.data["keypoints"].items():
-            self.keypoints[key], self.keypoint_scores[key] = self._cvt_kp(kps, val["id"])
-            self.keypoint_colors[key] = val["color"]
+        """
+        kpsは(keypoints, 3以上)の配列、x, yがNaNのkeypointは(0, 0)、scoreは0にする
+        """
+        if isinstance(kps, torch.Tensor):
+            kps = kps.cpu().numpy()
+        kps = np.asarray(kps, dtype=np.float64)[self.skeleton.ids]
+        is_nan = np.isnan(kps[:, 0]) | np.isnan(kps[:, 1])
+        self.points = np.where(is_nan[:, np.newaxis], 0, kps[:, :2]).astype(np.int32)
+        self.scores = np.where(is_nan, 0, kps[:, 2])
         self.line_color = (random.randint(180, 250), random.randint(180, 250), random.randint(180, 250))
-        self.label_keypoints = self.data["draw"]["labels"]
-        self.mask_points = self.data["draw"]["mask"]
-        self.draw_threshold = self.data["bones"]["threshold"]
 
     def set_track(self, trk):
-        if self.keypoints[self.label_keypoints[0]] != (0, 0):
-            self.pos = self.keypoints[self.label_keypoints[0]]
+        label_points = self.points[self.skeleton.labels]
+        if np.any(label_points[0] != 0):
+            self.pos = tuple(label_points[0].tolist())
         else:
-            self.pos = self.keypoints[self.label_keypoints[1]]
+            self.pos = tuple(label_points[1].tolist())
         self.id = trk
 
     def set_img(self, src_img):
@@ -44,38 +72,28 @@ class Annotate:
     def draw(self):
         # draw mask
         if self.draw_mask:
-            center_x = [self.keypoints[key][0] for key in self.mask_points if self.keypoints[key][0] != 0]
-            center_y = [self.keypoints[key][1] for key in self.mask_points if self.keypoints[key][1] != 0]
+            mask_points = self.points[self.skeleton.mask]
+            center_x = mask_points[mask_points[:, 0] != 0, 0]
+            center_y = mask_points[mask_points[:, 1] != 0, 1]
             if len(center_x) != 0 and len(center_y) != 0:
-                center = (int(sum(center_x) / len(center_x)), int(sum(center_y) / len(center_y)))
-                size = max(max(center_x) - min(center_x), max(center_y) - min(center_y))
+                center = (int(center_x.sum() / len(center_x)), int(center_y.sum() / len(center_y)))
+                size = max(center_x.max() - center_x.min(), center_y.max() - center_y.min())
                 img_draw.mosaic(self.dst_img, center, size, 10)
 
-        for bone in self.bones:
-            score_a = self.keypoint_scores[bone[0]]
-            score_b = self.keypoint_scores[bone[1]]
-            if score_a > self.draw_threshold and score_b > self.draw_threshold:
-                img_draw.draw_line(self.dst_img, self.keypoints[bone[0]], self.keypoints[bone[1]], self.line_color, 1)
+        # scoreがthreshold以下のkeypointにつながる骨は描かない、骨はすべて同じ色なのでまとめて描く
+        is_drawn = self.scores > self.skeleton.threshold
+        bones = self.skeleton.bones[is_drawn[self.skeleton.bones].all(axis=1)]
+        img_draw.draw_lines(self.dst_img, self.points[bones[:, 0]], self.points[bones[:, 1]], self.line_color, 1)
 
-        for key, val in self.keypoints.items():
-            if val[0] != 0 and val[1] != 0:
-                cv2.circle(self.dst_img, val, 3, self.keypoint_colors[key], -1)
+        points = self.points.tolist()
+        for i in np.flatnonzero((self.points[:, 0] != 0) & (self.points[:, 1] != 0)).tolist():
+            cv2.circle(self.dst_img, points[i], 3, self.skeleton.colors[i], -1)
 
         # draw label
         cv2.putText(self.dst_img, str(self.id), [self.pos[0] - 10, self.pos[1] - 35], cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
         cv2.line(self.dst_img, self.pos, (self.pos[0], self.pos[1] - 25), (50, 50, 255), 1, cv2.LINE_AA)
         return self.dst_img
 
-    def _cvt_kp(self, kp, idx):
-        x = kp[idx][0]
-        y = kp[idx][1]
-        if isinstance(x, torch.Tensor):
-            x = x.cpu()
-            y = y.cpu()
-        if np.isnan(x) or np.isnan(y):
-            return (0, 0), 0
-        return (int(kp[idx][0]), int(kp[idx][1])), kp[idx][2]
-
 
 def yolo_draw(src_img, result):
     anno = Annotate("coco17.toml")
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+
+class PoseFrameIndex:
+    """
+    (frame, member, keypoint)のTrackを描画用に(frame, member)ごとのposeの配列に詰め直す
+    poseはframe, memberの順に並べ、frameごとの開始位置(CSR形式のoffset)でそのframeのposeを切り出す
+    検出されたposeだけを持つので、短いIDが大量にあってもframes×membersの配列は作らない
+    検出されなかったkeypointはNaNで埋まる
+    """
+
+    def __init__(self, src_df, cols):
+        idx = src_df.index
+        frame_codes, self.frames = pd.factorize(idx.get_level_values("frame"), sort=True)
+        member_codes, self.members = pd.factorize(idx.get_level_values("member"))
+        keypoints = idx.get_level_values("keypoint")
+        if pd.api.types.is_integer_dtype(keypoints) and len(keypoints) > 0 and keypoints.min() >= 0:
+            # keypointが番号ならその番号の位置に置く、tomlのidでそのまま引ける
+            keypoint_codes = keypoints.to_numpy()
+            keypoint_num = keypoint_codes.max() + 1
+        else:
+            keypoint_codes, keypoint_labels = pd.factorize(keypoints)
+            keypoint_num = len(keypoint_labels)
+
+        # (frame, member)の組ごとに1つのpose、frame→memberの順に並ぶ
+        pose_keys, pose_ids = np.unique(frame_codes.astype(np.int64) * len(self.members) + member_codes, return_inverse=True)
+        pose_frames = pose_keys // len(self.members)
+        self.pose_members = pose_keys % len(self.members)
+        self.values = np.full((len(pose_keys), keypoint_num, len(cols)), np.nan, dtype=np.float32)
+        self.values[pose_ids, keypoint_codes] = src_df.loc[:, cols].to_numpy(dtype=np.float32)
+        # frame_offsets[row]からframe_offsets[row + 1]までがrow番目のframeのpose
+        self.frame_offsets = np.zeros(len(self.frames) + 1, dtype=np.int64)
+        self.frame_offsets[1:] = np.cumsum(np.bincount(pose_frames, minlength=len(self.frames)))
+        self.timestamps = np.full(len(self.frames), np.nan)
+        self.timestamps[frame_codes] = src_df["timestamp"].to_numpy(dtype=float)
+
+        self.timestamp_rows = dict(zip(self.timestamps.tolist(), range(len(self.frames)), strict=True))
+        self.frame_rows = dict(zip(self.frames.tolist(), range(len(self.frames)), strict=True))
+        self.member_cols = dict(zip(self.members.tolist(), range(len(self.members)), strict=True))
+
+    def scale(self, ratio):
+        """
+        x, yを描画する画像の大きさに合わせて拡大縮小する
+        """
+        self.values[..., :2] *= ratio
+
+    def get_kps(self, row, member):
+        """
+        rowのmemberのkeypointsを(keypoints, columns)の配列で返す、検出されていなければNone
+        """
+        col = self.member_cols.get(member)
+        if row is None or col is None:
+            return None
+        start, end = self.frame_offsets[row], self.frame_offsets[row + 1]
+        pos = start + np.searchsorted(self.pose_members[start:end], col)
+        if pos >= end or self.pose_members[pos] != col:
+            return None
+        return self.values[pos]
+
+    def get_poses(self, row):
+        """
+        rowで検出されているすべてのmemberを(member, keypoints)のリストで返す
+        """
+        if row is None:
+            return []
+        start, end = self.frame_offsets[row], self.frame_offsets[row + 1]
+        return [(self.members[self.pose_members[pos]], self.values[pos]) for pos in range(start, end)]
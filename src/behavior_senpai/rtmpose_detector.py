@@ -1,18 +1,19 @@
 import cv2
 import numpy as np
-import pandas as pd
+import torch
 from mmdet.apis import inference_detector, init_detector
+from mmengine.dataset import Compose, pseudo_collate
 from mmengine.registry import init_default_scope
-from mmpose.apis import inference_topdown, init_model
+from mmpose.apis import init_model
 from mmpose.evaluation.functional import nms
 from mmpose.registry import VISUALIZERS
 from mmpose.structures import merge_data_samples
 
-from behavior_senpai import img_draw, vcap
+from behavior_senpai import detect_pipeline, keypoint_buffer
 
 
 class RTMPoseDetector:
-    def __init__(self, whole_body=False, show=True):
+    def __init__(self, whole_body=False, show=True, batch_size=1, stride=1):
         if whole_body is True:
             config = "./mm_config/rtmpose-x_8xb32-270e_coco-wholebody-384x288.py"
             checkpoint = "https://download.openmmlab.com/mmpose/v1/projects/rtmposev1/rtmpose-x_simcc-coco-wholebody_pt-body7_270e-384x288-401dfc90_20230629.pth"
@@ -27,12 +28,18 @@ class RTMPoseDetector:
         self.pose_model = init_model(config, checkpoint, device="cuda:0")
         self.visualizer = VISUALIZERS.build(self.pose_model.cfg.visualizer)
         self.visualizer.set_dataset_meta(self.pose_model.dataset_meta)
+        self.pose_pipeline = Compose(self.pose_model.cfg.test_dataloader.dataset.pipeline)
 
         self.det_score_threshold = 0.3
         self.pose_score_threshold = 0.3
         self.retain_threshold = 0.3
         self.det_cat_id = 0
         self.show = show
+        self.checkpoint = None
+        # 何フレームずつまとめて推論するか
+        self.batch_size = batch_size
+        # 何フレームおきに検出するか
+        self.stride = stride
 
     def set_cap(self, cap):
         self.cap = cap
@@ -40,76 +47,112 @@ class RTMPoseDetector:
         self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
+    def set_checkpoint(self, checkpoint):
+        """
+        途中結果を書き出すCheckpoint、前回の続きのフレームから検出を再開する
+        """
+        self.checkpoint = checkpoint
+
     def detect(self, roi=False):
         # データの初期化
-        data_dict = {"frame": [], "member": [], "keypoint": [], "x": [], "y": [], "visible": [], "score": [], "timestamp": []}
-        for i in range(self.total_frame_num):
-            if roi is True:
-                ret, frame = self.cap.get_roi_frame()
-            else:
-                ret, frame = self.cap.read()
-            if ret is False:
-                print("Failed to read frame.")
-                continue
-            rgb_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-            scope = self.det_model.cfg.get("default_scope", "mmdet")
-            if scope is not None:
-                init_default_scope(scope)
-            # bbox検出
-            det_result = inference_detector(self.det_model, rgb_img)
+        self.buffer = keypoint_buffer.KeypointBuffer(["x", "y", "visible", "score"])
+        # デコードと描画は別スレッド、推論はこのスレッドで行う
+        start_frame = 0
+        if self.checkpoint is not None:
+            start_frame = self.checkpoint.get_start_frame()
+        reader = detect_pipeline.FrameReader(self.cap, self.total_frame_num, start_frame=start_frame, stride=self.stride)
+        self.preview = None
+        if self.show is True:
+            self.preview = detect_pipeline.PreviewRenderer(
+                lambda frame, results: self._draw(frame, merge_data_samples(results)), self.total_frame_num
+            )
+        try:
+            for batch in reader.batches(self.batch_size):
+                self._detect_batch(batch)
+                if self.checkpoint is not None:
+                    self.checkpoint.update(self.buffer, batch[-1][0])
+                # 検出結果を表示、xキーで途中終了
+                if self.preview is not None and self.preview.show() is True:
+                    break
+        finally:
+            # 例外で抜けても読み込みと描画のスレッドを残さない
+            reader.stop()
+            if self.preview is not None:
+                self.preview.stop()
+        self.completed = reader.finished
+
+        # keypointはここではintで保持する、indexでソートしたくなるかもしれないので
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.buffer, self.checkpoint.last_frame, force=True)
+            self.dst_df = self.checkpoint.load(self.buffer)
+        else:
+            self.dst_df = self.buffer.to_dataframe()
+
+    def _detect_batch(self, batch):
+        """
+        batchのフレームをまとめてbbox検出し、全フレームのbboxをまとめてkeypoint検出する
+        結果はフレーム番号ごとにbufferに詰め込む
+        """
+        rgb_imgs = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for _, frame, _ in batch]
+
+        scope = self.det_model.cfg.get("default_scope", "mmdet")
+        if scope is not None:
+            init_default_scope(scope)
+        # bbox検出
+        det_results = inference_detector(self.det_model, rgb_imgs)
+        bboxes_list = []
+        for det_result in det_results:
             pred_instance = det_result.pred_instances.cpu().numpy()
             bboxes = np.concatenate((pred_instance.bboxes, pred_instance.scores[:, None]), axis=1)
             bboxes = bboxes[np.logical_and(pred_instance.labels == self.det_cat_id, pred_instance.scores > self.det_score_threshold)]
             bboxes = bboxes[nms(bboxes, self.retain_threshold), :4]
             # x座標でソート
-            bboxes = bboxes[bboxes[:, 0].argsort()]
-            # keypoint検出
-            results = inference_topdown(self.pose_model, rgb_img, bboxes)
-            data_samples = merge_data_samples(results)
-            timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC)
-
-            # 検出結果を描画、xキーで途中終了
-            if self.show is True:
-                frame = self._draw(frame, data_samples)
-                _, frame = vcap.resize_frame(frame)
-                img_draw.put_frame_pos(frame, i, self.total_frame_num)
-                img_draw.put_message(frame, "'x' key to exit.", font_size=1.5, y=55)
-                cv2.imshow("dst", frame)
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord("x"):
-                    break
+            bboxes_list.append(bboxes[bboxes[:, 0].argsort()])
+        # keypoint検出
+        results_list = self._inference_topdown(rgb_imgs, bboxes_list)
+
+        for (i, frame, timestamp), results in zip(batch, results_list, strict=True):
+            if self.preview is not None:
+                self.preview.put(i, frame, results)
 
-            # 検出結果の取り出し
+            # 検出結果の取り出し、(members, keypoints, 4)の配列にまとめて詰め込む
+            result_keypoints = np.zeros((len(results), self.number_of_keypoints, 4))
             for member_id, keypoints in enumerate(results):
                 pred_instance = keypoints.pred_instances.cpu().numpy()
                 pred_instance.keypoints[pred_instance.keypoint_scores < self.pose_score_threshold] = 0
-                result_keypoints = np.concatenate(
+                result_keypoints[member_id] = np.concatenate(
                     (pred_instance.keypoints[0, :], pred_instance.keypoints_visible.T, pred_instance.keypoint_scores.T), axis=1
                 )
-                for k in range(self.number_of_keypoints):
-                    keypoint_id = k
-                    x = result_keypoints[k][0]
-                    y = result_keypoints[k][1]
-                    if roi is True:
-                        x += self.cap.left_top_point[0]
-                        y += self.cap.left_top_point[1]
-                    visible = result_keypoints[k][2]
-                    score = result_keypoints[k][3]
-
-                    # データの詰め込み
-                    data_dict["frame"].append(i)
-                    data_dict["member"].append(member_id)
-                    data_dict["keypoint"].append(keypoint_id)
-                    data_dict["x"].append(x)
-                    data_dict["y"].append(y)
-                    data_dict["visible"].append(visible)
-                    data_dict["score"].append(score)
-                    data_dict["timestamp"].append(timestamp)
+            # 推論したフレームの座標を元の動画の座標に戻す
+            result_keypoints[:, :, :2] = self.cap.to_frame_coords(result_keypoints[:, :, :2])
+            self.buffer.add(i, np.arange(len(results)), result_keypoints, timestamp)
 
-        # keypointはここではintで保持する、indexでソートしたくなるかもしれないので
-        self.dst_df = pd.DataFrame(data_dict).set_index(["frame", "member", "keypoint"])
-        cv2.destroyAllWindows()
+    def _inference_topdown(self, rgb_imgs, bboxes_list):
+        """
+        mmpose.apis.inference_topdown()を複数フレーム分まとめて1回のtest_stepで実行する
+        bboxがないフレームはinference_topdown()と同じく画像全体を1つのbboxとする
+        戻り値はフレームごとのPoseDataSampleのリスト
+        """
+        scope = self.pose_model.cfg.get("default_scope", "mmpose")
+        if scope is not None:
+            init_default_scope(scope)
+        data_list = []
+        bbox_nums = []
+        for rgb_img, bboxes in zip(rgb_imgs, bboxes_list, strict=True):
+            if len(bboxes) == 0:
+                h, w = rgb_img.shape[:2]
+                bboxes = np.array([[0, 0, w, h]], dtype=np.float32)
+            for bbox in bboxes:
+                data_info = {"img": rgb_img, "bbox": bbox[None], "bbox_score": np.ones(1, dtype=np.float32)}
+                data_info.update(self.pose_model.dataset_meta)
+                data_list.append(self.pose_pipeline(data_info))
+            bbox_nums.append(len(bboxes))
+        with torch.no_grad():
+            results = self.pose_model.test_step(pseudo_collate(data_list))
+
+        # フレームごとに分け直す
+        split_points = np.cumsum(bbox_nums)[:-1]
+        return [results[start:end] for start, end in zip([0, *split_points], [*split_points, len(results)], strict=True)]
 
     def get_result(self):
         return self.dst_df
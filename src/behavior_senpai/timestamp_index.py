@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class TimestampIndex:
+    """
+    timestampを一度だけ並べ替えておき、最も近いtimestampを二分探索で求める
+    スライダーやグラフをクリックするたびに全体をargsort/argminしないようにする
+    """
+
+    def __init__(self, timestamps):
+        timestamps = np.asarray(timestamps, dtype=float)
+        self.sorter = np.argsort(timestamps, kind="stable")
+        self.sorted_timestamps = timestamps[self.sorter]
+        # NaNは末尾に並ぶので探索の範囲から外す
+        self.size = len(self.sorted_timestamps) - np.count_nonzero(np.isnan(self.sorted_timestamps))
+
+    def nearest_index(self, msec):
+        """
+        msecに最も近いtimestampの、元の配列での位置を返す
+        """
+        pos = self._search(msec)
+        if pos is None:
+            return None
+        return self.sorter[pos]
+
+    def nearest(self, msec):
+        """
+        msecに最も近いtimestampを返す
+        """
+        pos = self._search(msec)
+        if pos is None:
+            return None
+        return self.sorted_timestamps[pos]
+
+    def _search(self, msec):
+        # 挿入位置の左右を比べて近い方、同じ距離なら小さい方を選ぶ
+        if self.size == 0:
+            return None
+        pos = np.searchsorted(self.sorted_timestamps[: self.size], msec)
+        if pos == self.size:
+            pos -= 1
+        elif pos > 0 and msec - self.sorted_timestamps[pos - 1] <= self.sorted_timestamps[pos] - msec:
+            pos -= 1
+        return pos
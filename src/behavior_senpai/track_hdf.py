@@ -0,0 +1,146 @@
+import inspect
+import os
+
+import numpy as np
+import pandas as pd
+
+TRK_KEY = "trk"
+# 1 chunk = 行グループ、frame範囲で読み出すときの単位になる
+CHUNK_ROWS = 2**16
+
+
+def write_trk(file_path, src_df):
+    """
+    Track fileをHDF5(table format)で保存する
+    indexの各level(frame, member, keypoint)とtimestampは検索可能なカラムとして保存される
+    文字列のlevelは整数コードで保存し、ラベルの表とattrsはtrkノードのattributeに保存する
+    """
+    dst_df, level_labels = _encode_index(src_df)
+    data_columns = [c for c in list(src_df.index.names) + ["timestamp"] if c in dst_df.columns]
+    with pd.HDFStore(file_path, mode="w", complevel=5, complib="blosc:lz4") as store:
+        store.append(
+            TRK_KEY,
+            dst_df,
+            data_columns=data_columns,
+            index=False,
+            expectedrows=len(dst_df),
+            chunksize=CHUNK_ROWS,
+        )
+        store.create_table_index(TRK_KEY, columns=[c for c in data_columns if c in [src_df.index.names[0], "timestamp"]], optlevel=6, kind="medium")
+        storer = store.get_storer(TRK_KEY)
+        storer.attrs.index_names = list(src_df.index.names)
+        storer.attrs.level_labels = level_labels
+        storer.attrs.trk_attrs = dict(src_df.attrs)
+    called_in = os.path.basename(inspect.stack()[1].filename)
+    print(f"{called_in} > {os.path.basename(file_path)}")
+
+
+def read_trk(file_path, where=None, columns=None):
+    """
+    HDF5のTrack fileを読み込む
+    whereを指定すると該当する行だけをディスクから読み込む
+    """
+    with pd.HDFStore(file_path, mode="r") as store:
+        if f"/{TRK_KEY}" not in store.keys():
+            raise ValueError(f"No track data found in {file_path}")
+        storer = store.get_storer(TRK_KEY)
+        index_names = storer.attrs.index_names
+        level_labels = storer.attrs.level_labels
+        attrs = storer.attrs.trk_attrs
+        if columns is not None:
+            columns = index_names + [c for c in columns if c not in index_names]
+        src_df = store.select(TRK_KEY, where=where, columns=columns)
+    dst_df = _decode_index(src_df, index_names, level_labels)
+    dst_df.attrs = attrs
+    return dst_df
+
+
+def read_trk_attrs(file_path):
+    """
+    データ本体を読み込まずにattrsだけを取得する
+    """
+    with pd.HDFStore(file_path, mode="r") as store:
+        return store.get_storer(TRK_KEY).attrs.trk_attrs
+
+
+def read_level_labels(file_path):
+    """
+    文字列で保存されたlevelのラベル表を返す
+    whereでmemberを指定するときにラベルをコードに変換するために使う
+    """
+    with pd.HDFStore(file_path, mode="r") as store:
+        return store.get_storer(TRK_KEY).attrs.level_labels
+
+
+def make_where(file_path, start_msec=None, end_msec=None, members=None, keypoints=None):
+    """
+    timestamp, member, keypointの条件をread_trk()のwhereに変換する
+    timestampの範囲はkeypoints_proc.filter_by_timerange()と同じく前後1msecの余裕を持たせる
+    ラベル表があるlevelはラベルを整数コードに変換して検索する
+    """
+    conditions = []
+    if start_msec is not None:
+        conditions.append(f"timestamp >= {start_msec - 1}")
+    if end_msec is not None:
+        conditions.append(f"timestamp <= {end_msec + 1}")
+    level_labels = read_level_labels(file_path)
+    for name, values in [("member", members), ("keypoint", keypoints)]:
+        if values is None:
+            continue
+        if name in level_labels.keys():
+            labels = level_labels[name]
+            values = [labels.index(str(v)) for v in values if str(v) in labels]
+        # 該当するラベルがない場合は1行も返さない
+        if len(values) == 0:
+            values = [-1]
+        values = [v.item() if isinstance(v, np.generic) else v for v in values]
+        conditions.append(f"{name} = {values}")
+    if len(conditions) == 0:
+        return None
+    return " & ".join(conditions)
+
+
+def _encode_index(src_df):
+    """
+    indexをカラムに展開する
+    table formatはobject型のlevelを文字列として1行ずつdecodeするため遅い、
+    intとstrが混在したmemberやkeypointはstrのラベル表と整数コードに分ける
+    """
+    idx = src_df.index
+    dst_df = pd.DataFrame(index=pd.RangeIndex(len(src_df)))
+    level_labels = {}
+    for i, name in enumerate(idx.names):
+        level = idx.levels[i]
+        if level.dtype == object:
+            labels = level.astype(str)
+            if labels.is_unique is True:
+                codes = idx.codes[i]
+            else:
+                codes, labels = pd.factorize(idx.get_level_values(i).astype(str))
+            level_labels[name] = labels.tolist()
+            dst_df[name] = np.asarray(codes, dtype=np.int32)
+        else:
+            dst_df[name] = idx.get_level_values(i).to_numpy()
+    for col in src_df.columns:
+        dst_df[col] = src_df[col].to_numpy()
+    return dst_df, level_labels
+
+
+def _decode_index(src_df, index_names, level_labels):
+    """
+    カラムに展開したindexをMultiIndexに戻す
+    ラベル表があるlevelは保存された整数コードをそのままcodesに使う
+    """
+    levels = []
+    codes = []
+    for name in index_names:
+        if name in level_labels.keys():
+            levels.append(pd.Index(level_labels[name], dtype=object))
+            codes.append(src_df[name].to_numpy())
+        else:
+            level_codes, level = pd.factorize(src_df[name].to_numpy(), sort=True)
+            levels.append(pd.Index(level))
+            codes.append(level_codes)
+    dst_df = src_df.drop(columns=index_names)
+    dst_df.index = pd.MultiIndex(levels=levels, codes=codes, names=index_names, verify_integrity=False)
+    return dst_df
@@ -0,0 +1,92 @@
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR_NAME = "mmap"
+
+
+def get_store_dir(trk_path):
+    """
+    Track fileと同じ階層のmmapフォルダにTrack fileごとのフォルダを作る
+    """
+    return os.path.join(os.path.dirname(trk_path), STORE_DIR_NAME, os.path.basename(trk_path))
+
+
+def is_store_valid(trk_path):
+    """
+    storeがあり、Track fileが更新されていなければTrue
+    """
+    meta_path = os.path.join(get_store_dir(trk_path), "meta.json")
+    if os.path.exists(meta_path) is False:
+        return False
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    stat = os.stat(trk_path)
+    return meta["src_mtime"] == stat.st_mtime and meta["src_size"] == stat.st_size
+
+
+def build_store(trk_path, src_df):
+    """
+    src_dfのカラムごとに.npyを保存する
+    indexはlevelごとにラベル(levels)と整数コード(codes)に分けて保存する
+    重複indexはここで削除しておく
+    attrsはpickleで保存する
+    開いているメモリマップを壊さないように、配列は作成するたびに別のフォルダ(generation)に保存する
+    """
+    store_dir = get_store_dir(trk_path)
+    stat = os.stat(trk_path)
+    generation = str(stat.st_mtime_ns)
+    gen_dir = os.path.join(store_dir, generation)
+    os.makedirs(gen_dir, exist_ok=True)
+    src_df = src_df[~src_df.index.duplicated(keep="first")]
+
+    idx = src_df.index
+    for i, name in enumerate(idx.names):
+        np.save(os.path.join(gen_dir, f"codes_{name}.npy"), np.asarray(idx.codes[i], dtype=np.int32))
+    levels = {name: idx.levels[i].tolist() for i, name in enumerate(idx.names)}
+    for col in src_df.columns:
+        np.save(os.path.join(gen_dir, f"col_{col}.npy"), src_df[col].to_numpy())
+    with open(os.path.join(gen_dir, "attrs.pkl"), "wb") as f:
+        pickle.dump(src_df.attrs, f)
+
+    meta = {
+        "generation": generation,
+        "src_mtime": stat.st_mtime,
+        "src_size": stat.st_size,
+        "index_names": list(idx.names),
+        "levels": levels,
+        "columns": src_df.columns.tolist(),
+    }
+    with open(os.path.join(store_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    # 古いgenerationを削除、Windowsでメモリマップ中のファイルは削除できないので残る
+    for name in os.listdir(store_dir):
+        if name not in [generation, "meta.json"]:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    print(f"build_store() (track_mmap): {os.path.basename(trk_path)} {len(src_df):,}rows")
+
+
+def load_store(trk_path):
+    """
+    カラムをメモリマップで開いてDataFrameにする
+    mmap_mode="c"(copy-on-write)なので書き換えたページだけがメモリにコピーされ、元の.npyは変更されない
+    MultiIndexは保存済みのコードから組み立てるので、indexの値を検索、ソートし直すことはない
+    """
+    store_dir = get_store_dir(trk_path)
+    with open(os.path.join(store_dir, "meta.json"), "r") as f:
+        meta = json.load(f)
+    gen_dir = os.path.join(store_dir, meta["generation"])
+    index_names = meta["index_names"]
+    codes = [np.load(os.path.join(gen_dir, f"codes_{name}.npy"), mmap_mode="r") for name in index_names]
+    levels = [pd.Index(meta["levels"][name]) for name in index_names]
+    index = pd.MultiIndex(levels=levels, codes=codes, names=index_names, verify_integrity=False)
+
+    cols = {col: np.load(os.path.join(gen_dir, f"col_{col}.npy"), mmap_mode="c") for col in meta["columns"]}
+    dst_df = pd.DataFrame(cols, index=index, copy=False)
+    with open(os.path.join(gen_dir, "attrs.pkl"), "rb") as f:
+        dst_df.attrs = pickle.load(f)
+    return dst_df
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# 速度で位置を予測するときに外挿する最大の時間
+EXTRAPOLATE_MSEC = 1000
+# 候補にならない組み合わせのコスト
+_NO_LINK_COST = 1e6
+
+
+def get_member_states(member_table, velocity_frames: int = 5):
+    """
+    memberごとに最初と最後のフレームのkeypointの重心、その前後velocity_framesフレームから求めた速度(px/msec)を求める
+    x, yがNaNのkeypointと削除した行は使わない
+    """
+    is_valid = member_table.is_valid & ~member_table.removed
+    x = member_table.src_df["x"].to_numpy(dtype=float)[is_valid]
+    y = member_table.src_df["y"].to_numpy(dtype=float)[is_valid]
+    frame_num = len(member_table.src_df.index.levels[member_table.frame_pos])
+    keys = member_table.member_codes[is_valid].astype(np.int64) * frame_num + member_table.frame_codes[is_valid]
+
+    # (member, frame)ごとの重心
+    keys, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    counts = np.bincount(inverse)
+    cx = np.bincount(inverse, weights=x) / counts
+    cy = np.bincount(inverse, weights=y) / counts
+    timestamps = member_table.timestamps[is_valid][first_rows]
+    members = keys // frame_num
+    order = np.lexsort((timestamps, members))
+    members, cx, cy, timestamps = members[order], cx[order], cy[order], timestamps[order]
+
+    # memberの境目から最初と最後の行を求める
+    heads = np.flatnonzero(np.r_[True, members[1:] != members[:-1]])
+    tails = np.r_[heads[1:], len(members)] - 1
+    head_refs = np.minimum(heads + velocity_frames, tails)
+    tail_refs = np.maximum(tails - velocity_frames, heads)
+    start_vx, start_vy = _velocity(cx, cy, timestamps, heads, head_refs)
+    end_vx, end_vy = _velocity(cx, cy, timestamps, tail_refs, tails)
+
+    codes = members[heads]
+    return pd.DataFrame(
+        {
+            "member": np.array(member_table.labels, dtype=object)[codes],
+            "start": timestamps[heads],
+            "end": timestamps[tails],
+            "start_x": cx[heads],
+            "start_y": cy[heads],
+            "start_vx": start_vx,
+            "start_vy": start_vy,
+            "end_x": cx[tails],
+            "end_y": cy[tails],
+            "end_vx": end_vx,
+            "end_vy": end_vy,
+            "frames": tails - heads + 1,
+        },
+        index=pd.Index(codes, name="code"),
+    )
+
+
+def find_candidates(states, max_gap_msec: int):
+    """
+    memberが終わってからmax_gap_msec以内に始まるmemberを候補にする
+    開始時刻を並べ替えて二分探索するので、全ての組み合わせは作らない
+    """
+    start = states["start"].to_numpy()
+    end = states["end"].to_numpy()
+    start_order = np.argsort(start, kind="stable")
+    sorted_start = start[start_order]
+    lo = np.searchsorted(sorted_start, end, side="right")
+    hi = np.searchsorted(sorted_start, end + max_gap_msec, side="right")
+    counts = hi - lo
+    src = np.repeat(np.arange(len(states)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    dst = start_order[np.repeat(lo, counts) + offsets]
+    return src, dst
+
+
+def calc_costs(states, src, dst, max_gap_msec: int, max_distance: float, velocity_weight: float = 0.5):
+    """
+    srcの最後の位置を速度で外挿した位置とdstの最初の位置の距離、速度の変化、間の時間からコストを求める
+    距離がmax_distanceを超える組み合わせはNaN
+    """
+    gap = states["start"].to_numpy()[dst] - states["end"].to_numpy()[src]
+    extrapolate = np.minimum(gap, EXTRAPOLATE_MSEC)
+    pred_x = states["end_x"].to_numpy()[src] + states["end_vx"].to_numpy()[src] * extrapolate
+    pred_y = states["end_y"].to_numpy()[src] + states["end_vy"].to_numpy()[src] * extrapolate
+    distance = np.hypot(states["start_x"].to_numpy()[dst] - pred_x, states["start_y"].to_numpy()[dst] - pred_y)
+    # 速度の変化はpx/secにしてmax_distanceで割る
+    velocity_change = np.hypot(
+        states["start_vx"].to_numpy()[dst] - states["end_vx"].to_numpy()[src],
+        states["start_vy"].to_numpy()[dst] - states["end_vy"].to_numpy()[src],
+    )
+    cost = distance / max_distance + velocity_weight * velocity_change * 1000 / max_distance + gap / max_gap_msec
+    return np.where(distance <= max_distance, cost, np.nan)
+
+
+def solve_links(member_num: int, src, dst, cost):
+    """
+    1つのmemberの後ろにつながるのは1つまで、前につながるのも1つまでとしてコストの合計が最小になる組み合わせを選ぶ
+    候補の組み合わせでつながったグループごとにlinear_sum_assignmentで解く
+    """
+    is_candidate = ~np.isnan(cost)
+    src, dst, cost = src[is_candidate], dst[is_candidate], cost[is_candidate]
+    if len(src) == 0:
+        return src, dst
+
+    # 終わり側をmember_num未満、始まり側をmember_num以上の節点にした二部グラフ
+    graph = coo_matrix((np.ones(len(src)), (src, dst + member_num)), shape=(member_num * 2, member_num * 2))
+    _, group_labels = connected_components(graph, directed=False)
+    edge_groups = group_labels[src]
+    group_sizes = np.bincount(edge_groups)
+
+    # 候補が1つしかないグループはそのままつなぐ
+    is_single = group_sizes[edge_groups] == 1
+    link_src, link_dst = [src[is_single]], [dst[is_single]]
+    order = np.argsort(edge_groups[~is_single], kind="stable")
+    multi_src, multi_dst, multi_cost = src[~is_single][order], dst[~is_single][order], cost[~is_single][order]
+    bounds = np.flatnonzero(np.diff(edge_groups[~is_single][order])) + 1
+    for group_src, group_dst, group_cost in zip(np.split(multi_src, bounds), np.split(multi_dst, bounds), np.split(multi_cost, bounds), strict=True):
+        if len(group_src) == 0:
+            continue
+        rows, row_codes = np.unique(group_src, return_inverse=True)
+        cols, col_codes = np.unique(group_dst, return_inverse=True)
+        cost_matrix = np.full((len(rows), len(cols)), _NO_LINK_COST)
+        cost_matrix[row_codes, col_codes] = group_cost
+        row_ind, col_ind = linear_sum_assignment(cost_matrix)
+        is_link = cost_matrix[row_ind, col_ind] < _NO_LINK_COST
+        link_src.append(rows[row_ind[is_link]])
+        link_dst.append(cols[col_ind[is_link]])
+    return np.concatenate(link_src), np.concatenate(link_dst)
+
+
+def stitch_members(member_table, max_gap_msec: int = 1000, max_distance: float = 100, velocity_frames: int = 5, velocity_weight: float = 0.5):
+    """
+    途切れたmemberをつなぎ、{元のmember: つなげた先頭のmember}のrenameの対応を返す
+    つながらないmemberは含まない
+    """
+    states = get_member_states(member_table, velocity_frames)
+    if len(states) < 2:
+        return {}
+    src, dst = find_candidates(states, max_gap_msec)
+    cost = calc_costs(states, src, dst, max_gap_msec, max_distance, velocity_weight)
+    link_src, link_dst = solve_links(len(states), src, dst, cost)
+
+    # つながりをたどって先頭のmemberを求める
+    parents = np.arange(len(states))
+    parents[link_dst] = link_src
+    while True:
+        grand_parents = parents[parents]
+        if np.array_equal(grand_parents, parents):
+            break
+        parents = grand_parents
+    labels = states["member"].to_numpy()
+    changed = np.flatnonzero(parents != np.arange(len(states)))
+    return dict(zip(labels[changed].tolist(), labels[parents[changed]].tolist(), strict=True))
+
+
+def _velocity(cx, cy, timestamps, from_rows, to_rows):
+    dt = timestamps[to_rows] - timestamps[from_rows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vx = np.where(dt > 0, (cx[to_rows] - cx[from_rows]) / dt, 0.0)
+        vy = np.where(dt > 0, (cy[to_rows] - cy[from_rows]) / dt, 0.0)
+    return vx, vy
@@ -2,6 +2,8 @@ import os
 
 import pandas as pd
 
+from . import file_inout
+
 
 def concat_track_file(head_df, trk_dir, trk_prefix=""):
     """
@@ -18,7 +20,7 @@ def concat_track_file(head_df, trk_dir, trk_prefix=""):
         print(f"next_path({next_path}) is not found")
         return None
 
-    next_df = pd.read_pickle(next_path)
+    next_df = file_inout.read_track_file(next_path)
     prev_max_frame = head_df.index.get_level_values("frame").max()
     next_df.index = next_df.index.set_levels(next_df.index.levels[0] + prev_max_frame + 1, level=0)
 
@@ -1,49 +1,439 @@
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+
 import cv2
 import numpy as np
 
 from behavior_senpai import img_draw
 
+# read_at()でキャッシュするフレームの合計サイズの上限
+FRAME_CACHE_BYTES = 512 * 2**20
+# read_at()したフレームの前後何フレームを先読みするか
+READ_AHEAD_FRAMES = 30
+READ_BEHIND_FRAMES = 10
+# PTSのindexが一致しているとみなす誤差(msec)
+PTS_TOLERANCE_MSEC = 0.5
+# MultiVcapで同時に開いておく動画の数
+MULTI_VCAP_POOL_SIZE = 3
+# 分割された動画の長さを保存しておくファイル、動画と同じフォルダに作る
+DURATION_CACHE_NAME = "video_msec.json"
+
+
+def get_pts_index_path(video_path):
+    return f"{video_path}.pts.npz"
+
+
+def load_pts_index(video_path):
+    """
+    動画の横に保存したフレームごとのPTS(msec)を読み込む、ないか動画が更新されていたらNone
+    """
+    index_path = get_pts_index_path(video_path)
+    if os.path.exists(index_path) is False:
+        return None
+    stat = os.stat(video_path)
+    with np.load(index_path) as npz:
+        if npz["src_size"] != stat.st_size or npz["src_mtime"] != stat.st_mtime:
+            return None
+        return npz["pts"]
+
+
+def build_pts_index(video_path, stop_event=None):
+    """
+    動画を先頭からgrab()してフレームごとのPTS(msec)を集め、動画の横に保存する
+    stop_eventがセットされたら途中でやめてNoneを返す
+    """
+    cap = cv2.VideoCapture(video_path)
+    pts_list = []
+    while cap.grab() is True:
+        if stop_event is not None and stop_event.is_set():
+            cap.release()
+            return None
+        pts_list.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+    cap.release()
+    pts = np.array(pts_list, dtype=np.float64)
+    if len(pts) == 0:
+        return None
+    stat = os.stat(video_path)
+    try:
+        np.savez(get_pts_index_path(video_path), pts=pts, src_size=stat.st_size, src_mtime=stat.st_mtime)
+    except OSError:
+        print(f"Failed to save PTS index: {video_path}")
+    return pts
+
+
+class PtsIndexBuilder:
+    """
+    別スレッドでbuild_pts_index()を行い、できたらcallback(video_path, pts)を呼ぶ
+    stop()で途中でやめられる、終了時に動いているものは止めてから終わる
+    """
+
+    running = set()
+
+    def __init__(self, video_path, callback):
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(video_path, callback), daemon=True)
+        PtsIndexBuilder.running.add(self)
+        self.thread.start()
+
+    def stop(self, join=False):
+        self.stop_event.set()
+        if join is True:
+            self.thread.join()
+
+    def _run(self, video_path, callback):
+        try:
+            pts = build_pts_index(video_path, self.stop_event)
+            if pts is not None and self.stop_event.is_set() is False:
+                callback(video_path, pts)
+        finally:
+            PtsIndexBuilder.running.discard(self)
+
+
+@atexit.register
+def _stop_pts_index_builders():
+    # デコード中のスレッドを残したまま終了するとプロセスが異常終了する
+    for builder in list(PtsIndexBuilder.running):
+        builder.stop(join=True)
+
+
+class FrameCache:
+    """
+    フレーム番号をキーにしたLRUキャッシュ、合計のバイト数で上限を決める
+    """
+
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, frame_num):
+        with self.lock:
+            frame = self.frames.get(frame_num)
+            if frame is not None:
+                self.frames.move_to_end(frame_num)
+            return frame
+
+    def put(self, frame_num, frame):
+        with self.lock:
+            if frame_num in self.frames:
+                self.frames.move_to_end(frame_num)
+                return
+            self.frames[frame_num] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes and len(self.frames) > 1:
+                _, old_frame = self.frames.popitem(last=False)
+                self.nbytes -= old_frame.nbytes
+
+    def has_all(self, frame_nums):
+        with self.lock:
+            return all(frame_num in self.frames for frame_num in frame_nums)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+
+
+class ReadAhead:
+    """
+    read_at()とは別のVideoCaptureで、指定したフレームの前後を順番にデコードしてFrameCacheに入れる
+    新しい要求が来たら今の先読みは途中でやめる
+    別の動画を開いたら世代を進め、古い世代でデコードしたフレームはキャッシュに入れない
+    stop()でスレッドを止める、終了時に動いているものは止めてから終わる
+    """
+
+    running = set()
+
+    def __init__(self, cache, msec_to_frame):
+        self.cache = cache
+        self.msec_to_frame = msec_to_frame
+        self.file_path = None
+        self.request = None
+        self.is_reopen = False
+        self.generation = 0
+        self.is_stopped = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        ReadAhead.running.add(self)
+        self.thread.start()
+
+    def open(self, file_path):
+        with self.cond:
+            self.file_path = file_path
+            self.request = None
+            self.is_reopen = True
+            self.generation += 1
+
+    def invalidate(self):
+        """
+        フレーム番号の対応が変わったときに、先読み中のフレームをキャッシュに入れないようにする
+        """
+        with self.cond:
+            self.generation += 1
+
+    def request_around(self, frame_num):
+        with self.cond:
+            self.request = frame_num
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.is_stopped = True
+            self.cond.notify()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self):
+        cap = cv2.VideoCapture()
+        try:
+            self._read_loop(cap)
+        finally:
+            cap.release()
+            ReadAhead.running.discard(self)
+
+    def _read_loop(self, cap):
+        while True:
+            with self.cond:
+                while self.request is None and self.is_stopped is False:
+                    self.cond.wait()
+                if self.is_stopped is True:
+                    return
+                frame_num = self.request
+                self.request = None
+                generation = self.generation
+                if self.is_reopen is True:
+                    cap.open(self.file_path)
+                    self.is_reopen = False
+            start = max(frame_num - READ_BEHIND_FRAMES, 0)
+            end = frame_num + READ_AHEAD_FRAMES
+            if cap.isOpened() is False or self.cache.has_all(range(start, end)) is True:
+                continue
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            for _ in range(start, end):
+                if self.request is not None or self.generation != generation or self.is_stopped is True:
+                    break
+                ok, frame = cap.read()
+                if ok is False:
+                    break
+                with self.cond:
+                    # open()の後に古い動画のフレームが入らないように、世代の確認とputをまとめて行う
+                    if self.generation != generation:
+                        break
+                    self.cache.put(self.msec_to_frame(cap.get(cv2.CAP_PROP_POS_MSEC)), frame)
+
+
+@atexit.register
+def _stop_read_aheads():
+    # 先読みでデコード中のスレッドを残したまま終了するとプロセスが異常終了する
+    for read_ahead in list(ReadAhead.running):
+        read_ahead.stop()
+
+
+def read_max_msec(file_path):
+    """
+    最後のフレームをデコードして動画の長さ(msec)を求める
+    """
+    cap = cv2.VideoCapture(file_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count - 1)
+    ret, _ = cap.read()
+    if ret is False:
+        print("Failed to read last frame.")
+    max_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+    cap.release()
+    return max_msec
+
+
+def get_max_msec_list(file_path_list):
+    """
+    動画それぞれの長さ(msec)
+    PTSのindexか、前回求めてDURATION_CACHE_NAMEに保存した値があれば動画をデコードしない
+    """
+    max_msec_list = []
+    caches = {}
+    for file_path in file_path_list:
+        cache_path = os.path.join(os.path.dirname(file_path), DURATION_CACHE_NAME)
+        if cache_path not in caches.keys():
+            cache = {}
+            if os.path.exists(cache_path):
+                with open(cache_path, "r") as f:
+                    cache = json.load(f)
+            caches[cache_path] = cache
+        cache = caches[cache_path]
+
+        stat = os.stat(file_path)
+        name = os.path.basename(file_path)
+        pts_index = load_pts_index(file_path)
+        if pts_index is not None:
+            max_msec = float(pts_index[-1])
+        elif name in cache.keys() and cache[name]["src_size"] == stat.st_size and cache[name]["src_mtime"] == stat.st_mtime:
+            max_msec = cache[name]["max_msec"]
+        else:
+            max_msec = read_max_msec(file_path)
+        cache[name] = {"src_size": stat.st_size, "src_mtime": stat.st_mtime, "max_msec": max_msec}
+        max_msec_list.append(max_msec)
+
+    for cache_path, cache in caches.items():
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(cache, f, indent=2)
+        except OSError:
+            print(f"Failed to save {cache_path}")
+    return max_msec_list
+
 
 class VideoCap(cv2.VideoCapture):
-    def __init__(self):
+    def __init__(self, cache_bytes=FRAME_CACHE_BYTES):
         super().__init__()
         self.frame_size = (0, 0)
         self.max_msec = 0
+        self.fps = 0
+        self.file_path = None
+        self.pts_index = None
+        # read_at()で最後に返したフレームのmsec、キャッシュから返すとVideoCaptureの位置は動かない
+        self.read_at_msec = None
+        # PTSのindexは1つのVideoCapで1本ずつ作る
+        self.pts_builder = None
+        self.frame_cache = FrameCache(cache_bytes)
+        self.read_ahead = ReadAhead(self.frame_cache, self.msec_to_frame)
 
     def open_file(self, file_path):
         """
         動画ファイルを開く
         initで開くとsegfaultの原因になるため、open_file()を使う
+        PTSのindexがあればmax_msecはindexから求める、なければ最後のフレームを読んで求め、indexは裏で作る
         """
+        self._stop_pts_builder()
         ok = self.open(file_path, apiPreference=cv2.CAP_ANY, params=[cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
         if ok is False:
             print(f"Failed to open {file_path}")
+        self.fps = self.get(cv2.CAP_PROP_FPS)
+        if self.fps <= 0:
+            self.fps = 29.97
+        self.file_path = file_path
+        self.pts_index = load_pts_index(file_path) if ok is True else None
+        self.read_at_msec = None
+        # release()の後に開き直したときは先読みのスレッドを作り直す
+        if self.read_ahead.is_stopped is True:
+            self.read_ahead = ReadAhead(self.frame_cache, self.msec_to_frame)
+        # 先読みの世代を進めてからキャッシュを空にする
+        self.read_ahead.open(file_path)
+        self.frame_cache.clear()
+
+        if self.pts_index is not None:
+            self.max_msec = self.pts_index[-1]
+            return
         frame_count = int(self.get(cv2.CAP_PROP_FRAME_COUNT))
         self.set(cv2.CAP_PROP_POS_FRAMES, frame_count - 1)
         ret, _ = self.read()
         if ret is False:
             print("Failed to read last frame.")
         self.max_msec = self.get(cv2.CAP_PROP_POS_MSEC)
+        if ok is True:
+            self.pts_builder = PtsIndexBuilder(file_path, self._set_pts_index)
+
+    def release(self):
+        self._stop_pts_builder(join=True)
+        self.read_ahead.stop()
+        super().release()
+
+    def msec_to_frame(self, msec):
+        """
+        msec以前で最も近いフレームの番号、indexがなければfpsから求める
+        """
+        pts_index = self.pts_index
+        if pts_index is None:
+            return round(msec * self.fps / 1000)
+        frame_num = np.searchsorted(pts_index, msec + PTS_TOLERANCE_MSEC, side="right") - 1
+        return int(min(max(frame_num, 0), len(pts_index) - 1))
 
     def read_at(self, msec, scale=None, rgb=False, read_anyway=True):
         """
         ミリ秒を指定してreadする
+        一度読んだフレームと先読みしたフレームはFrameCacheから返す
         """
-        self.set_frame_pos(msec)
-        ok, frame = self.read()
-        msec = self.get(cv2.CAP_PROP_POS_MSEC)
+        # seek中のCAP_PROP_POS_MSECはVideoCaptureの位置を返すようにしておく
+        self.read_at_msec = None
+        frame_num = self.msec_to_frame(msec)
+        frame = self.frame_cache.get(frame_num)
+        if frame is None:
+            if self.pts_index is not None:
+                ok, frame = self._read_exact(frame_num)
+            else:
+                self.set_frame_pos(msec)
+                ok, frame = self.read()
+            if ok is True:
+                self.frame_cache.put(frame_num, frame)
+        else:
+            ok = True
+        self.read_ahead.request_around(frame_num)
+        self.read_at_msec = self.pts_index[frame_num] if self.pts_index is not None else frame_num * 1000 / self.fps
         if ok is False:
             if read_anyway is False:
                 return ok, frame
             else:
                 ok = True
                 frame = self.dummy_frame
+        # キャッシュしたフレームを呼び出し元で書き換えられないようにする
+        if rgb is False and scale is None:
+            frame = frame.copy()
         if rgb is True:
             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         if scale is not None:
             frame = cv2.resize(frame, None, fx=scale, fy=scale)
         return ok, frame
 
+    def get(self, prop_id):
+        """
+        read_at()の後のCAP_PROP_POS_MSECは、キャッシュから返した場合も含めて最後に返したフレームのmsecにする
+        """
+        if prop_id == cv2.CAP_PROP_POS_MSEC and self.read_at_msec is not None:
+            return float(self.read_at_msec)
+        return super().get(prop_id)
+
+    def read(self, *args, **kwargs):
+        self.read_at_msec = None
+        return super().read(*args, **kwargs)
+
+    def _read_exact(self, frame_num):
+        """
+        目的のフレームより手前にseekし、PTSが一致するフレームまでgrab()で進めてから読む
+        seekが目的のフレームを追い越した場合(VFRなど)はさらに手前からやり直す
+        """
+        tar_msec = self.pts_index[frame_num]
+        back = 1
+        while True:
+            self.set(cv2.CAP_PROP_POS_FRAMES, max(frame_num - back, 0))
+            ok = self.grab()
+            pos_msec = self.get(cv2.CAP_PROP_POS_MSEC)
+            if ok is False or pos_msec <= tar_msec + PTS_TOLERANCE_MSEC or frame_num - back <= 0:
+                break
+            back *= 4
+        while ok is True and pos_msec < tar_msec - PTS_TOLERANCE_MSEC:
+            ok = self.grab()
+            pos_msec = self.get(cv2.CAP_PROP_POS_MSEC)
+        if ok is False:
+            return False, None
+        return self.retrieve()
+
+    def _stop_pts_builder(self, join=False):
+        if self.pts_builder is not None:
+            self.pts_builder.stop(join=join)
+            self.pts_builder = None
+
+    def _set_pts_index(self, file_path, pts_index):
+        # 作っている間に別の動画を開いていたら使わない
+        if self.file_path != file_path:
+            return
+        self.pts_index = pts_index
+        # fpsから求めたフレーム番号でキャッシュしたフレームは捨てる
+        self.read_ahead.invalidate()
+        self.frame_cache.clear()
+
     def read_anyway(self):
         """
         readに失敗したら黒画像を返す
@@ -54,6 +444,7 @@ class VideoCap(cv2.VideoCapture):
         return frame
 
     def set_frame_pos(self, msec):
+        self.read_at_msec = None
         self.set(cv2.CAP_PROP_POS_MSEC, msec)
 
     def get_frame_size(self):
@@ -73,27 +464,30 @@ class VideoCap(cv2.VideoCapture):
 class MultiVcap:
     """
     分割されたmp4に対して、通しのmsecでread_atするためのクラス
+    最近使ったMULTI_VCAP_POOL_SIZE個の動画は開いたままにして、境界をまたぐたびに開き直さない
     """
 
     def __init__(self, vcap):
         self.vcap = vcap
         self.file_path_list = []
         self.current_file_idx = 0
+        self.frame_size = vcap.get_frame_size()
+        # 動画の番号: VideoCap、最後に使ったものが末尾
+        self.pool = OrderedDict()
+        self.spare_vcaps = [vcap]
 
     def open_files(self, file_path_list):
-        total_msec_list = []
-        total_msec = 0
-        for file_path in file_path_list:
-            self.vcap.open_file(file_path)
-            total_msec += self.vcap.get_max_msec()
-            total_msec_list.append(total_msec)
+        total_msec_list = np.cumsum(get_max_msec_list(file_path_list))
 
         # file_path_listとtotal_msec_listは先頭が最初の動画になっていること
         self.total_msec_list = np.array(total_msec_list)
         self.file_path_list = file_path_list
-        self.vcap.open_file(self.file_path_list[0])
-        self.current_file_idx = 0
-        self.isOpened = self.vcap.isOpened
+        self.spare_vcaps += self.pool.values()
+        self.pool.clear()
+        self._switch_vcap(0)
+
+    def isOpened(self):
+        return self.vcap.isOpened()
 
     def set_frame_pos(self, msec):
         tar_idx, msec = self._search_file_idx_and_msec(msec)
@@ -104,11 +498,31 @@ class MultiVcap:
         ok, frame = self.vcap.read_at(msec, scale=scale, rgb=rgb, read_anyway=read_anyway)
         return ok, frame
 
+    def read_anyway(self):
+        """
+        今の動画の続きを読み、最後まで読んだら次の動画の先頭から読む
+        readに失敗したら黒画像を返す
+        """
+        ok, frame = self.vcap.read()
+        while ok is False and self.current_file_idx + 1 < len(self.file_path_list):
+            self._switch_vcap(self.current_file_idx + 1)
+            self.vcap.set_frame_pos(0)
+            ok, frame = self.vcap.read()
+        if ok is False:
+            frame = self.vcap.dummy_frame
+        return frame
+
     def get(self, prop_id):
-        return self.vcap.get(prop_id)
+        value = self.vcap.get(prop_id)
+        # CAP_PROP_POS_MSECは通しのmsecにする
+        if prop_id == cv2.CAP_PROP_POS_MSEC and self.current_file_idx > 0:
+            value += self.total_msec_list[self.current_file_idx - 1]
+        return value
 
     def set_frame_size(self, frame_size):
-        self.vcap.set_frame_size(frame_size)
+        self.frame_size = frame_size
+        for vcap in list(self.pool.values()) + self.spare_vcaps:
+            vcap.set_frame_size(frame_size)
 
     def get_frame_size(self):
         return self.vcap.get_frame_size()
@@ -117,14 +531,32 @@ class MultiVcap:
         self.file_path_list = []
         self.current_file_idx = 0
 
+    def _switch_vcap(self, tar_idx):
+        """
+        tar_idx番目の動画を開いたVideoCapに切り替える
+        poolになければ空いているVideoCap、なければ一番使っていないVideoCapで開く
+        """
+        if tar_idx in self.pool.keys():
+            self.pool.move_to_end(tar_idx)
+        else:
+            if len(self.spare_vcaps) > 0:
+                vcap = self.spare_vcaps.pop()
+            elif len(self.pool) < MULTI_VCAP_POOL_SIZE:
+                vcap = VideoCap(cache_bytes=FRAME_CACHE_BYTES // MULTI_VCAP_POOL_SIZE)
+            else:
+                _, vcap = self.pool.popitem(last=False)
+            vcap.set_frame_size(self.frame_size)
+            vcap.open_file(self.file_path_list[tar_idx])
+            self.pool[tar_idx] = vcap
+        self.vcap = self.pool[tar_idx]
+        self.current_file_idx = tar_idx
+
     def _search_file_idx_and_msec(self, msec):
         tar_idx = np.searchsorted(self.total_msec_list, msec, side="left")
         if tar_idx >= len(self.total_msec_list):
             return None, None
         if tar_idx != self.current_file_idx:
-            tar_path = self.file_path_list[tar_idx]
-            self.vcap.open_file(tar_path)
-            self.current_file_idx = tar_idx
+            self._switch_vcap(tar_idx)
         if tar_idx == 0:
             ret_msec = msec
         else:
@@ -135,6 +567,8 @@ class MultiVcap:
 class RoiCap(cv2.VideoCapture):
     def __init__(self):
         super().__init__()
+        # 推論に使うフレームの高さ、Noneなら元の解像度のまま
+        self.infer_height = None
 
     def open_file(self, file_path):
         """
@@ -147,16 +581,27 @@ class RoiCap(cv2.VideoCapture):
 
         self.width = int(self.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.height = int(self.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.left_top_point = (0, 0)
-        self.right_bottom_point = (self.width, self.height)
-        self.roi_width = self.right_bottom_point[0] - self.left_top_point[0]
-        self.roi_height = self.right_bottom_point[1] - self.left_top_point[1]
+        self.set_roi((0, 0), (self.width, self.height))
 
     def set_roi(self, left_top_point, right_bottom_point):
         self.left_top_point = left_top_point
         self.right_bottom_point = right_bottom_point
         self.roi_width = right_bottom_point[0] - left_top_point[0]
         self.roi_height = right_bottom_point[1] - left_top_point[1]
+        # ROIの高さがinfer_heightを超える場合だけ縮小する
+        if self.infer_height is not None and self.roi_height > self.infer_height:
+            self.infer_size = (round(self.roi_width * self.infer_height / self.roi_height), self.infer_height)
+        else:
+            self.infer_size = (self.roi_width, self.roi_height)
+        # (x, y)それぞれの元の解像度/推論の解像度、幅は丸めているので縦横で少し違う
+        self.infer_scale = (self.roi_width / self.infer_size[0], self.roi_height / self.infer_size[1])
+
+    def set_infer_height(self, infer_height):
+        """
+        get_roi_frame()が返すフレームの高さを指定する
+        """
+        self.infer_height = infer_height
+        self.set_roi(self.left_top_point, self.right_bottom_point)
 
     def get_left_top(self):
         return self.left_top_point
@@ -164,12 +609,21 @@ class RoiCap(cv2.VideoCapture):
     def get_roi_frame(self):
         """
         read()と互換
+        ROIの切り出しはコピーしないスライスで行い、縮小はデコード直後に1回だけ行う
         """
         ok, frame = self.read()
         if ok is True:
             frame = frame[self.left_top_point[1] : self.right_bottom_point[1], self.left_top_point[0] : self.right_bottom_point[0]]
+            if self.infer_size != (self.roi_width, self.roi_height):
+                frame = cv2.resize(frame, self.infer_size, interpolation=cv2.INTER_AREA)
         return ok, frame
 
+    def to_frame_coords(self, points):
+        """
+        get_roi_frame()のフレーム上の座標(..., 2)を元の動画の座標に戻す
+        """
+        return points * np.asarray(self.infer_scale, dtype=float) + np.asarray(self.left_top_point, dtype=float)
+
     def set_frame_pos(self, msec):
         self.set(cv2.CAP_PROP_POS_MSEC, msec)
 
@@ -1,12 +1,11 @@
 import cv2
-import pandas as pd
 from ultralytics import YOLO
 
-from behavior_senpai import img_draw, pose_drawer, vcap
+from behavior_senpai import detect_pipeline, keypoint_buffer, pose_drawer
 
 
 class YoloDetector:
-    def __init__(self, show=True, model="YOLO11 x-pose"):
+    def __init__(self, show=True, model="YOLO11 x-pose", batch_size=1, stride=1):
         if model == "YOLO11 x-pose":
             model = "yolo11x-pose"
         elif model == "YOLOv8 x-pose-p6":
@@ -15,63 +14,82 @@ class YoloDetector:
 
         self.number_of_keypoints = 17
         self.show = show
+        self.checkpoint = None
+        # 再開したときに前回のmember IDと重ならないように足す値
+        self.member_offset = 0
+        # 何フレームずつまとめて推論するか
+        self.batch_size = batch_size
+        # 何フレームおきに検出するか
+        self.stride = stride
 
     def set_cap(self, cap):
         self.cap = cap
         self.total_frame_num = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # 同じモデルで別の動画を処理するときはtrackerのIDを振り直す
+        predictor = self.model.predictor
+        if predictor is not None and hasattr(predictor, "trackers"):
+            for tracker in predictor.trackers:
+                tracker.reset()
+
+    def set_checkpoint(self, checkpoint):
+        """
+        途中結果を書き出すCheckpoint、前回の続きのフレームから検出を再開する
+        """
+        self.checkpoint = checkpoint
 
     def detect(self, roi=False):
         # データの初期化
-        data_dict = {"frame": [], "member": [], "keypoint": [], "x": [], "y": [], "conf": [], "timestamp": []}
-        for i in range(self.total_frame_num):
-            if roi is True:
-                ret, frame = self.cap.get_roi_frame()
-            else:
-                ret, frame = self.cap.read()
-            if ret is False:
-                print("Failed to read frame.")
-                continue
-
-            result = self.model.track(frame, verbose=False, persist=True, classes=0)
-            timestamp = self.cap.get(cv2.CAP_PROP_POS_MSEC)
-
-            # 検出結果を描画、xキーで途中終了
-            if self.show is True:
-                frame = pose_drawer.yolo_draw(frame, result)
-                _, frame = vcap.resize_frame(frame)
-                img_draw.put_frame_pos(frame, i, self.total_frame_num)
-                img_draw.put_message(frame, "'x' key to exit.", font_size=1.5, y=55)
-                cv2.imshow("dst", frame)
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord("x"):
+        self.buffer = keypoint_buffer.KeypointBuffer(["x", "y", "conf"])
+        # デコードと描画は別スレッド、推論はこのスレッドで行う
+        start_frame = 0
+        self.member_offset = 0
+        if self.checkpoint is not None:
+            start_frame = self.checkpoint.get_start_frame()
+            # trackerは作り直されて1からIDを振るので、書き出し済みのIDの続きにする
+            if start_frame > 0:
+                self.member_offset = max(self.checkpoint.max_member, 0)
+        reader = detect_pipeline.FrameReader(self.cap, self.total_frame_num, start_frame=start_frame, stride=self.stride)
+        self.preview = None
+        if self.show is True:
+            self.preview = detect_pipeline.PreviewRenderer(lambda frame, result: pose_drawer.yolo_draw(frame, [result]), self.total_frame_num)
+        try:
+            for batch in reader.batches(self.batch_size):
+                self._detect_batch(batch)
+                if self.checkpoint is not None:
+                    self.checkpoint.update(self.buffer, batch[-1][0])
+                # 検出結果を表示、xキーで途中終了
+                if self.preview is not None and self.preview.show() is True:
                     break
-
-            # 検出結果の取り出し
-            result_keypoints = result[0].keypoints.data
-            result_boxes = result[0].boxes.data
-            for keypoints, boxes in zip(result_keypoints, result_boxes, strict=False):
-                member_id = int(boxes[4])
-                for k in range(self.number_of_keypoints):
-                    keypoint_id = k
-                    x = float(keypoints[k][0])
-                    y = float(keypoints[k][1])
-                    if roi is True:
-                        x += self.cap.left_top_point[0]
-                        y += self.cap.left_top_point[1]
-                    conf = float(keypoints[k][2])
-
-                    # データの詰め込み
-                    data_dict["frame"].append(i)
-                    data_dict["member"].append(member_id)
-                    data_dict["keypoint"].append(keypoint_id)
-                    data_dict["x"].append(x)
-                    data_dict["y"].append(y)
-                    data_dict["conf"].append(conf)
-                    data_dict["timestamp"].append(timestamp)
+        finally:
+            # 例外で抜けても読み込みと描画のスレッドを残さない
+            reader.stop()
+            if self.preview is not None:
+                self.preview.stop()
+        self.completed = reader.finished
 
         # memberとkeypointはここではintで保持する、indexでソートしたくなるかもしれないので
-        self.dst_df = pd.DataFrame(data_dict).set_index(["frame", "member", "keypoint"])
-        cv2.destroyAllWindows()
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.buffer, self.checkpoint.last_frame, force=True)
+            self.dst_df = self.checkpoint.load(self.buffer)
+        else:
+            self.dst_df = self.buffer.to_dataframe()
+
+    def _detect_batch(self, batch):
+        """
+        batchのフレームをまとめて推論し、結果をフレーム番号ごとにbufferに詰め込む
+        trackerはフレーム順に更新されるのでmember_idは1フレームずつ推論した場合と同じになる
+        """
+        results = self.model.track([frame for _, frame, _ in batch], verbose=False, persist=True, classes=0)
+        for (i, frame, timestamp), result in zip(batch, results, strict=True):
+            if self.preview is not None:
+                self.preview.put(i, frame, result)
+
+            # 検出結果の取り出し、(members, keypoints, 3)の配列のまま詰め込む
+            result_keypoints = result.keypoints.data.cpu().numpy().astype(float)
+            member_ids = result.boxes.data[:, 4].cpu().numpy().astype(int) + self.member_offset
+            # 推論したフレームの座標を元の動画の座標に戻す
+            result_keypoints[:, :, :2] = self.cap.to_frame_coords(result_keypoints[:, :, :2])
+            self.buffer.add(i, member_ids, result_keypoints[:, : self.number_of_keypoints], timestamp)
 
     def get_result(self):
         return self.dst_df
@@ -0,0 +1,150 @@
+"""Run the detector on many videos without GUI.
+
+usage: python detect_cli.py <folder or glob> --model "YOLO11 x-pose" --workers 2
+"""
+
+import argparse
+import datetime
+import glob
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import detector_proc
+from behavior_senpai import detect_checkpoint, vcap
+
+# ワーカープロセスごとに1つだけ初期化するDetector
+_model = None
+_model_name = None
+_batch_size = 1
+_stride = 1
+_interpolate = False
+_infer_height = None
+
+
+def find_videos(tar_path):
+    """
+    フォルダならその中のmp4とmov(再帰しない)、それ以外はglobのパターンとして扱う
+    """
+    if os.path.isdir(tar_path):
+        video_paths = glob.glob(os.path.join(tar_path, "*.mp4"))
+        video_paths += glob.glob(os.path.join(tar_path, "*.mov"))
+    else:
+        video_paths = glob.glob(tar_path)
+    return sorted(os.path.abspath(p) for p in video_paths)
+
+
+def is_up_to_date(model_name, video_path, add_suffix):
+    """
+    Track file(.trkがなければ以前の形式の.pkl)があり、動画より新しければTrue
+    途中で中断した動画(.partが残っている)は続きを検出するのでFalse
+    """
+    trk_path = detector_proc.get_trk_path(model_name, video_path, add_suffix)
+    if os.path.exists(detect_checkpoint.get_checkpoint_path(trk_path)) is True:
+        return False
+    for tar_path in [trk_path, os.path.splitext(trk_path)[0] + ".pkl"]:
+        if os.path.exists(tar_path) is True:
+            return os.path.getmtime(tar_path) >= os.path.getmtime(video_path)
+    return False
+
+
+def _init_worker(model_name, batch_size, stride, interpolate, infer_height):
+    global _model, _model_name, _batch_size, _stride, _interpolate, _infer_height
+    _model_name = model_name
+    _batch_size = batch_size
+    _stride = stride
+    _interpolate = interpolate
+    _infer_height = infer_height
+    # MediaPipe Holisticは追跡の状態を持つので動画ごとにプロセスごと作り直す
+    if model_name != "MediaPipe Holistic":
+        _model = detector_proc.load_model(model_name, batch_size, show=False, stride=stride)
+
+
+def _detect_video(video_path, add_suffix):
+    start = time.perf_counter()
+    row = {"video": video_path, "trk": "", "status": "done", "rows": 0, "elapsed_sec": 0.0, "error": ""}
+    try:
+        model = _model
+        if model is None:
+            model = detector_proc.load_model(_model_name, _batch_size, show=False, stride=_stride)
+        rcap = vcap.RoiCap()
+        row["trk"] = detector_proc.exec(
+            rcap, _model_name, video_path, add_suffix=add_suffix, model=model, interpolate=_interpolate, infer_height=_infer_height
+        )
+        row["rows"] = len(model.get_result())
+    except Exception:
+        row["status"] = "failed"
+        row["error"] = traceback.format_exc(limit=3)
+    row["elapsed_sec"] = round(time.perf_counter() - start, 1)
+    return row
+
+
+def run(tar_path, model_name, workers=1, batch_size=1, add_suffix=False, force=False, stride=1, interpolate=False, infer_height=None):
+    """
+    tar_pathに該当する動画をworkers個のプロセスで並列に処理し、動画ごとの結果をDataFrameで返す
+    """
+    video_paths = find_videos(tar_path)
+    rows = []
+    todo_paths = []
+    for video_path in video_paths:
+        if force is False and is_up_to_date(model_name, video_path, add_suffix) is True:
+            trk_path = detector_proc.get_trk_path(model_name, video_path, add_suffix)
+            rows.append({"video": video_path, "trk": trk_path, "status": "skipped", "rows": 0, "elapsed_sec": 0.0, "error": ""})
+        else:
+            todo_paths.append(video_path)
+    print(f"{datetime.datetime.now()} {len(todo_paths)} videos to detect, {len(rows)} up to date")
+
+    # CUDAを使うのでforkではなくspawnでワーカーを起動する
+    max_tasks_per_child = 1 if model_name == "MediaPipe Holistic" else None
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_name, batch_size, stride, interpolate, infer_height),
+        max_tasks_per_child=max_tasks_per_child,
+    ) as executor:
+        futures = [executor.submit(_detect_video, video_path, add_suffix) for video_path in todo_paths]
+        for future in as_completed(futures):
+            row = future.result()
+            print(f"{datetime.datetime.now()} {row['status']} {row['video']} ({row['elapsed_sec']}s)")
+            rows.append(row)
+    return pd.DataFrame(rows, columns=["video", "trk", "status", "rows", "elapsed_sec", "error"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect keypoints in videos without GUI.")
+    parser.add_argument("tar_path", help="folder of videos (not recursive) or glob pattern such as 'videos/*.mp4'")
+    parser.add_argument("--model", default="YOLO11 x-pose", choices=list(detector_proc.SUFFIXES.keys()))
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes, each loads its own model")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--stride", type=int, default=1, help="run the pose model on every k-th frame only")
+    parser.add_argument("--interpolate", action="store_true", help="fill the frames skipped by --stride with linear interpolation")
+    parser.add_argument("--infer-height", type=int, default=None, help="downscale frames (or the ROI) to this height before inference")
+    parser.add_argument("--add-suffix", action="store_true", help="add a suffix indicating the engine to the track file name")
+    parser.add_argument("--force", action="store_true", help="detect again even if the track file is newer than the video")
+    parser.add_argument("--summary", default=None, help="path of the run summary CSV")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary_df = run(
+        args.tar_path, args.model, args.workers, args.batch_size, args.add_suffix, args.force, args.stride, args.interpolate, args.infer_height
+    )
+
+    summary_path = args.summary
+    if summary_path is None:
+        summary_path = f"detect_summary_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    summary_df.to_csv(summary_path, index=False)
+    counts = summary_df["status"].value_counts()
+    print(
+        f"{datetime.datetime.now()} Done: {counts.get('done', 0)} done, {counts.get('skipped', 0)} skipped, "
+        f"{counts.get('failed', 0)} failed in {time.perf_counter() - start:.1f}s"
+    )
+    print(f"summary: {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ import importlib.util
 import os
 import time
 
-from behavior_senpai import file_inout, mediapipe_detector
+from behavior_senpai import detect_checkpoint, file_inout, keypoints_proc, mediapipe_detector
 
 
 def is_module_available(module_name):
@@ -29,42 +29,81 @@ def check_gpu():
     return YOLOV8_AVAILABLE, MMPOSE_AVAILABLE
 
 
-def exec(rcap, model_name, video_path, use_roi=False, add_suffix=False):
-    # 動画の読み込み
-    rcap.open_file(video_path)
+# 出力するTrack fileのsuffix
+SUFFIXES = {
+    "YOLO11 x-pose": "yolo11",
+    "YOLOv8 x-pose-p6": "yolov8_p6",
+    "MediaPipe Holistic": "mp_holistic",
+    "RTMPose-x Halpe26": "rtm_halpe26",
+    "RTMPose-x WholeBody133": "rtm_coco133",
+}
 
-    if use_roi is True:
-        rcap.click_roi()
 
-    file_name = os.path.splitext(os.path.basename(video_path))[0]
-    trk_dir = os.path.join(os.path.dirname(video_path), "trk")
-    os.makedirs(trk_dir, exist_ok=True)
-
-    # モデルの初期化
+def load_model(model_name, batch_size=1, show=True, stride=1):
+    """
+    model_nameに対応するDetectorを初期化する
+    """
     if model_name in ["YOLO11 x-pose", "YOLOv8 x-pose-p6"]:
-        model = yolo_detector.YoloDetector(model=model_name)
-        if model_name == "YOLO11 x-pose":
-            suffix = "yolo11"
-        else:
-            suffix = "yolov8_p6"
+        model = yolo_detector.YoloDetector(show=show, model=model_name, batch_size=batch_size, stride=stride)
     elif model_name == "MediaPipe Holistic":
-        model = mediapipe_detector.MediaPipeDetector()
-        suffix = "mp_holistic"
+        # MediaPipe Holisticは前フレームの結果を使って追跡するため1フレームずつ推論する
+        model = mediapipe_detector.MediaPipeDetector(show=show, stride=stride)
     elif model_name == "RTMPose-x Halpe26":
-        model = rtmpose_detector.RTMPoseDetector()
-        suffix = "rtm_halpe26"
+        model = rtmpose_detector.RTMPoseDetector(show=show, batch_size=batch_size, stride=stride)
     elif model_name == "RTMPose-x WholeBody133":
-        model = rtmpose_detector.RTMPoseDetector(whole_body=True)
-        suffix = "rtm_coco133"
+        model = rtmpose_detector.RTMPoseDetector(whole_body=True, show=show, batch_size=batch_size, stride=stride)
+    return model
+
+
+def get_trk_path(model_name, video_path, add_suffix=False):
+    """
+    動画と同じ階層のtrkフォルダに保存するTrack fileのパス
+    """
+    file_name = os.path.splitext(os.path.basename(video_path))[0]
+    trk_dir = os.path.join(os.path.dirname(video_path), "trk")
     if add_suffix is True:
-        dst_file_name = f"{file_name}_{suffix}.pkl"
+        dst_file_name = f"{file_name}_{SUFFIXES[model_name]}{file_inout.TRACK_FILE_EXT}"
     else:
-        dst_file_name = f"{file_name}.pkl"
-    pkl_path = os.path.join(trk_dir, dst_file_name)
+        dst_file_name = f"{file_name}{file_inout.TRACK_FILE_EXT}"
+    return os.path.join(trk_dir, dst_file_name)
+
+
+def exec(rcap, model_name, video_path, use_roi=False, add_suffix=False, batch_size=1, model=None, stride=1, interpolate=False, infer_height=None):
+    """
+    modelを渡すと初期化済みのDetectorを使い回す、渡さなければmodel_nameから初期化する
+    途中結果はtrk/*.trk.partに書き出し、中断した動画は続きのフレームから再開する
+    stride>1ならstrideフレームおきに検出し、interpolate=Trueなら間のフレームを線形補間で埋める
+    infer_heightを指定するとROIをその高さに縮小してから推論する、座標は元の動画の解像度で保存される
+    """
+    # 動画の読み込み
+    rcap.open_file(video_path)
+    rcap.set_infer_height(infer_height)
 
+    if use_roi is True:
+        rcap.click_roi()
+
+    pkl_path = get_trk_path(model_name, video_path, add_suffix)
+    os.makedirs(os.path.dirname(pkl_path), exist_ok=True)
+
+    # モデルの初期化
+    if model is None:
+        model = load_model(model_name, batch_size, stride=stride)
+
+    settings = {
+        "stride": model.stride,
+        "roi": [int(v) for v in (*rcap.left_top_point, *rcap.right_bottom_point)],
+        "infer_height": infer_height,
+    }
+    checkpoint = detect_checkpoint.Checkpoint(pkl_path, model_name, video_path, settings=settings)
     model.set_cap(rcap)
+    model.set_checkpoint(checkpoint)
     model.detect(roi=use_roi)
     result_df = model.get_result()
+    # 最後のフレームまで検出できた場合だけ.partを削除する
+    if model.completed is True:
+        checkpoint.remove()
+    if interpolate is True:
+        result_df = keypoints_proc.interpolate_stride(result_df, model.stride, rcap.get_left_top())
 
     # attrsを埋め込み
     result_df.attrs["model"] = model_name
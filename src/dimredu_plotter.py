@@ -3,11 +3,10 @@ import time
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 from matplotlib import gridspec, ticker
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
-from behavior_senpai import img_draw, mediapipe_drawer, pose_drawer, time_format
+from behavior_senpai import img_draw, mediapipe_drawer, pose_drawer, pose_frame_index, time_format, timestamp_index
 
 
 class DimensionalReductionPlotter:
@@ -29,6 +28,7 @@ class DimensionalReductionPlotter:
         self.picker_range = None
         self.plot_df = None
         self.timestamps = np.array([])
+        self.timestamp_index = timestamp_index.TimestampIndex(self.timestamps)
 
     def pack(self, master):
         self.canvas = FigureCanvasTkAgg(self.fig, master=master)
@@ -58,8 +58,7 @@ class DimensionalReductionPlotter:
         elif trk_df.attrs["model"] == "DeepLabCut":
             self.anno = pose_drawer.Annotate("deeplabcut.toml")
             cols_for_anno = ["x", "y", "likelihood"]
-        self.anno_df = trk_df.reset_index().set_index(["timestamp", "member", "keypoint"]).loc[:, cols_for_anno]
-        self.anno_time_member_indexes = self.anno_df.index.droplevel(2).unique()
+        self.pose_index = pose_frame_index.PoseFrameIndex(trk_df, cols_for_anno)
         print(f"set_trk_df() (dimredu_plotter.DimensionalReductionPlotter): {time.perf_counter() - start_time:.3f}sec")
 
     def set_init_class_names(self, class_names):
@@ -77,6 +76,7 @@ class DimensionalReductionPlotter:
             self.plot_df["class"] = 0
         self.plot_df.loc[self.plot_df["umap_t"].isna(), "class"] = np.nan
         self.timestamps = self.plot_df["timestamp"].to_numpy()
+        self.timestamp_index = timestamp_index.TimestampIndex(self.timestamps)
 
         self.line_ax.cla()
 
@@ -173,7 +173,7 @@ class DimensionalReductionPlotter:
             return
 
         timestamp_msec = float(x)
-        idx = np.fabs(self.timestamps - timestamp_msec).argmin()
+        idx = self.timestamp_index.nearest_index(timestamp_msec)
 
         mask = ~np.isnan(self.plot_df.iloc[idx]["umap_t"])
         if mask:
@@ -193,7 +193,7 @@ class DimensionalReductionPlotter:
             return
 
         timestamp_msec = float(x)
-        idx = np.fabs(self.timestamps - timestamp_msec).argmin()
+        idx = self.timestamp_index.nearest_index(timestamp_msec)
         timestamp_msec = self.timestamps[idx]
 
         if event.button == 3:
@@ -222,9 +222,8 @@ class DimensionalReductionPlotter:
             return
 
         if self.draw_anno is True:
-            if (timestamp_msec, self.member) in self.anno_time_member_indexes:
-                tar_df = self.anno_df.loc[pd.IndexSlice[timestamp_msec, self.member, :], :]
-                kps = tar_df.to_numpy()
+            kps = self.pose_index.get_kps(self.pose_index.timestamp_rows.get(timestamp_msec), self.member)
+            if kps is not None:
                 self.anno.set_img(frame)
                 self.anno.set_pose(kps)
                 self.anno.set_track(self.member)
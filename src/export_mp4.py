@@ -1,12 +1,21 @@
+import collections
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
 
 import cv2
-import pandas as pd
 
-from behavior_senpai import mediapipe_drawer, pose_drawer
+from behavior_senpai import file_inout, keypoints_proc, mediapipe_drawer, pose_drawer, pose_frame_index
 from gui_parts import TempFile
 
+# 描画するスレッド数と、1スレッドにまとめて渡すフレーム数
+RENDER_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+CHUNK_FRAMES = 16
+# デコード済みフレームを先読みしておく数
+PREFETCH_FRAMES = RENDER_WORKERS * CHUNK_FRAMES * 2
+
 
 class MakeMp4:
     def __init__(self):
@@ -20,15 +29,19 @@ class MakeMp4:
         self.time_max = None
         self.pkl_dir = args["pkl_dir"]
         self.track_name = args["trk_pkl_name"]
+        # src_dfと同じ内容のTrack file、Noneならsrc_dfから切り出す
+        self.trk_path = args.get("trk_path")
 
     def set_time_range(self, time_min, time_max):
         self.time_min = time_min
         self.time_max = time_max
 
     def export(self):
-        tar_df = self.src_df
-        idx = tar_df.index
-        tar_df.index = tar_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str), idx.levels[2].astype(str)])
+        """
+        デコードは1スレッド、描画はRENDER_WORKERS個のスレッドでCHUNK_FRAMESずつ行い、フレーム番号順に書き出す
+        プレビュー表示はPreferenceのExport mp4 previewで切り替える
+        """
+        tar_df = self._get_tar_df()
 
         if self.cap.isOpened() is True:
             fps = self.cap.get(cv2.CAP_PROP_FPS)
@@ -38,23 +51,11 @@ class MakeMp4:
 
         tmp = TempFile()
         scale = tmp.get_mp4_setting()
+        show = tmp.get_mp4_preview()
+        draw_mask = tmp.get_draw_mask()
 
         file_name = os.path.splitext(self.track_name)[0]
-        if self.src_attrs["model"] in ["YOLOv8 x-pose-p6", "YOLO11 x-pose"]:
-            anno = pose_drawer.Annotate("coco17.toml")
-            suffix = "yolo"
-        elif self.src_attrs["model"] == "MediaPipe Holistic":
-            anno = mediapipe_drawer.Annotate()
-            suffix = "mediapipe"
-        elif self.src_attrs["model"] in ["MMPose RTMPose-x", "RTMPose-x Halpe26"]:
-            anno = pose_drawer.Annotate("halpe26.toml")
-            suffix = "rtm_halpe26"
-        elif self.src_attrs["model"] == "RTMPose-x WholeBody133":
-            anno = pose_drawer.Annotate("coco133.toml")
-            suffix = "rtm_coco133"
-        elif self.src_attrs["model"] == "DeepLabCut":
-            anno = pose_drawer.Annotate("deeplabcut.toml")
-            suffix = "deeplabcut"
+        toml_name, cols_for_anno, suffix = self._get_anno_setting()
 
         dst_dir = os.path.join(self.pkl_dir, os.pardir, "mp4")
         os.makedirs(dst_dir, exist_ok=True)
@@ -64,42 +65,59 @@ class MakeMp4:
         size = (int(size[0] * scale), int(size[1] * scale))
         self.out.open(out_file_path, fourcc, fps, size, params=[cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
 
-        out_df = tar_df
-        if self.time_min is None or self.time_max is None:
-            min_frame_num = out_df.index.unique(level="frame").min()
-            max_frame_num = out_df.index.unique(level="frame").max() + 1
-        else:
-            min_frame_num = out_df[out_df["timestamp"] >= self.time_min].index.unique(level="frame").min()
-            max_frame_num = out_df[out_df["timestamp"] <= self.time_max].index.unique(level="frame").max() + 1
+        min_frame_num, max_frame_num = self._get_frame_range(tar_df)
+        pose_index = pose_frame_index.PoseFrameIndex(tar_df, cols_for_anno)
+        pose_index.scale(scale)
 
-        out_indexes = out_df.sort_index().index
-        frames = out_indexes.get_level_values("frame").unique()
-        for i in range(min_frame_num, max_frame_num):
-            frame = self.cap.read_anyway()
-            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
-            anno.set_img(frame)
-            if i in frames:
-                frame_df = out_df.loc[pd.IndexSlice[i, :, :], :]
-                indexes = frame_df.sort_index().index
-                for member in indexes.get_level_values("member").unique():
-                    dst_img = self._draw(out_df, i, member, indexes, anno, scale)
-            else:
+        local = threading.local()
+
+        def render_chunk(chunk):
+            # Annotateは描画中の画像やposeを持つのでスレッドごとに作る
+            if getattr(local, "anno", None) is None:
+                local.anno = self._make_anno(toml_name, draw_mask)
+            anno = local.anno
+            dst_imgs = []
+            for i, frame in chunk:
                 dst_img = frame
-            cv2.imshow("dst", dst_img)
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord("x"):
-                break
-            self.out.write(dst_img)
-        cv2.destroyAllWindows()
+                poses = pose_index.get_poses(pose_index.frame_rows.get(i))
+                if len(poses) > 0:
+                    anno.set_img(frame)
+                    for member, kps in poses:
+                        anno.set_pose(kps)
+                        anno.set_track(member)
+                        dst_img = anno.draw()
+                dst_imgs.append(dst_img)
+            return dst_imgs
+
+        reader = _FrameReader(self.cap, min_frame_num, max_frame_num, size)
+        # 描画が終わったchunkを先頭から順に書き出すので、futuresが並べ替えのバッファになる
+        futures = collections.deque()
+        is_exit = False
+        try:
+            with ThreadPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+                for chunk in reader.chunks(CHUNK_FRAMES):
+                    futures.append(executor.submit(render_chunk, chunk))
+                    while len(futures) > RENDER_WORKERS * 2 or (len(futures) > 0 and futures[0].done()):
+                        is_exit = self._write(futures.popleft().result(), show)
+                        if is_exit:
+                            break
+                    if is_exit:
+                        break
+                while is_exit is False and len(futures) > 0:
+                    is_exit = self._write(futures.popleft().result(), show)
+                for future in futures:
+                    future.cancel()
+        finally:
+            reader.stop()
+        if show is True:
+            cv2.destroyAllWindows()
         self.out.release()
         mp4_name = os.path.basename(out_file_path)
         messagebox.showinfo("Export MP4", f"Export finished.\nfile name: {mp4_name}")
         return mp4_name
 
     def extract(self):
-        tar_df = self.src_df
-        idx = tar_df.index
-        tar_df.index = tar_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str), idx.levels[2].astype(str)])
+        tar_df = self._get_tar_df()
 
         if self.cap.isOpened() is True:
             fps = self.cap.get(cv2.CAP_PROP_FPS)
@@ -115,15 +133,7 @@ class MakeMp4:
         size = self.src_attrs["frame_size"]
         self.out.open(out_file_path, fourcc, fps, size, params=[cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
 
-        out_df = tar_df
-        if self.time_min is None or self.time_max is None:
-            min_frame_num = out_df.index.unique(level="frame").min()
-            max_frame_num = out_df.index.unique(level="frame").max() + 1
-        else:
-            # between time_min and time_max ["timestamp"]column
-            min_frame_num = out_df[out_df["timestamp"] >= self.time_min].index.unique(level="frame").min()
-            max_frame_num = out_df[out_df["timestamp"] <= self.time_max].index.unique(level="frame").max() + 1
-
+        min_frame_num, max_frame_num = self._get_frame_range(tar_df)
         for i in range(min_frame_num, max_frame_num):
             frame = self.cap.read_anyway()
             cv2.imshow("dst", frame)
@@ -137,15 +147,128 @@ class MakeMp4:
         messagebox.showinfo("Export MP4", f"Export finished.\nfile name: {mp4_name}")
         return mp4_name
 
-    def _draw(self, out_df, frame_num, member, all_indexes, anno, scale):
-        if (frame_num, member) not in all_indexes.droplevel(2):
-            return anno.dst_img
-        keypoints = out_df.loc[pd.IndexSlice[frame_num, member, :], :].copy()
-        if "x" in keypoints.columns:
-            keypoints.loc[:, ["x", "y"]] *= scale
-        kps = keypoints.to_numpy()
-        anno.set_pose(kps)
-        anno.set_track(member)
-        # anno.mosaic(240*scale)
-        dst_img = anno.draw()
-        return dst_img
+    def _get_tar_df(self):
+        """
+        time_min, time_maxが指定されていれば先にその範囲だけを切り出してからindexを並べ替える
+        Track fileがあればその範囲だけをファイルから読み込む
+        """
+        tar_df = None
+        if self.time_min is None or self.time_max is None:
+            tar_df = self.src_df.copy(deep=False)
+        elif self.trk_path is not None:
+            tar_df = self._load_time_range()
+        if tar_df is None:
+            tar_df = keypoints_proc.filter_by_timerange(self.src_df, self.time_min, self.time_max).copy(deep=False)
+        idx = tar_df.index
+        tar_df.index = tar_df.index.set_levels([idx.levels[0], idx.levels[1].astype(str), idx.levels[2].astype(str)])
+        return tar_df
+
+    def _load_time_range(self):
+        """
+        time_minからtime_maxまでの行だけをTrack fileから読み込み、launcherで読み込んだときと同じ前処理をする
+        """
+        tar_df = file_inout.load_track_file(self.trk_path, start_msec=self.time_min, end_msec=self.time_max)
+        if tar_df is None:
+            return None
+        tar_df = keypoints_proc.zero_point_to_nan(tar_df)
+        return tar_df[~tar_df.index.duplicated(keep="first")]
+
+    def _get_frame_range(self, tar_df):
+        if self.time_min is None or self.time_max is None:
+            min_frame_num = tar_df.index.unique(level="frame").min()
+            max_frame_num = tar_df.index.unique(level="frame").max() + 1
+        else:
+            # between time_min and time_max ["timestamp"]column
+            min_frame_num = tar_df[tar_df["timestamp"] >= self.time_min].index.unique(level="frame").min()
+            max_frame_num = tar_df[tar_df["timestamp"] <= self.time_max].index.unique(level="frame").max() + 1
+        return min_frame_num, max_frame_num
+
+    def _get_anno_setting(self):
+        """
+        modelに対応するskeletonのtomlファイル名(MediaPipeはNone)、描画に使うカラム、出力ファイル名のsuffixを返す
+        """
+        if self.src_attrs["model"] in ["YOLOv8 x-pose-p6", "YOLO11 x-pose"]:
+            return "coco17.toml", ["x", "y", "conf"], "yolo"
+        elif self.src_attrs["model"] == "MediaPipe Holistic":
+            return None, ["x", "y", "z"], "mediapipe"
+        elif self.src_attrs["model"] in ["MMPose RTMPose-x", "RTMPose-x Halpe26"]:
+            return "halpe26.toml", ["x", "y", "score"], "rtm_halpe26"
+        elif self.src_attrs["model"] == "RTMPose-x WholeBody133":
+            return "coco133.toml", ["x", "y", "score"], "rtm_coco133"
+        elif self.src_attrs["model"] == "DeepLabCut":
+            return "deeplabcut.toml", ["x", "y", "likelihood"], "deeplabcut"
+
+    def _make_anno(self, toml_name, draw_mask):
+        if toml_name is None:
+            return mediapipe_drawer.Annotate()
+        return pose_drawer.Annotate(toml_name, draw_mask)
+
+    def _write(self, dst_imgs, show):
+        """
+        描画済みのフレームを書き出す、プレビュー中にxキーが押されたらTrueを返す
+        """
+        for dst_img in dst_imgs:
+            if show is True:
+                cv2.imshow("dst", dst_img)
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord("x"):
+                    return True
+            self.out.write(dst_img)
+        return False
+
+
+class _FrameReader:
+    """
+    別スレッドで動画をデコードして出力サイズに縮小し、(frame番号, frame)をキューに先読みする
+    """
+
+    def __init__(self, cap, min_frame_num, max_frame_num, size, maxsize=PREFETCH_FRAMES):
+        self.cap = cap
+        self.min_frame_num = min_frame_num
+        self.max_frame_num = max_frame_num
+        self.size = size
+        # 読み込みスレッドで起きた例外、chunks()で投げ直す
+        self.error = None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def chunks(self, chunk_size):
+        chunk = []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                if self.error is not None:
+                    raise self.error
+                break
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def stop(self):
+        self.stop_event.set()
+        # キューが満杯でput()で止まっているスレッドを動かすために読み捨てる
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+    def _read(self):
+        try:
+            for i in range(self.min_frame_num, self.max_frame_num):
+                if self.stop_event.is_set():
+                    break
+                frame = self.cap.read_anyway()
+                frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                self.queue.put((i, frame))
+        except Exception as e:
+            self.error = e
+        finally:
+            # 例外で抜けてもchunks()が止まったままにならないように必ず終わりを知らせる
+            self.queue.put(None)
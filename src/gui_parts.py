@@ -416,6 +416,8 @@ class TempFile:
             "dt_span": 10,
             "thinning": 0,
             "draw_mask": False,
+            "mmap_load": False,
+            "mp4_preview": True,
         }
 
         file_name = "temp.pkl"
@@ -487,6 +489,12 @@ class TempFile:
     def get_draw_mask(self):
         return self.data["draw_mask"]
 
+    def get_mmap_load(self):
+        return self.data["mmap_load"]
+
+    def get_mp4_preview(self):
+        return self.data["mp4_preview"]
+
     def _find_data_dir(self):
         if getattr(sys, "frozen", False):
             # The application is frozen
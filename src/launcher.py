@@ -187,11 +187,14 @@ class App(ttk.Frame):
         keypoints_btn.pack(padx=(10, 0), pady=(5, 0), expand=True, fill=tk.X)
 
         self.vcap = vcap.VideoCap()
+        # 分割された動画用、開いたVideoCapのpoolを使い回すため1つだけ作る
+        self.multi_vcap = vcap.MultiVcap(self.vcap)
         self.cap = self.vcap
         self.pkl_path = ""
         self.pkl_dir = None
         self.src_df = None
         self.time_span = None
+        self.member_summary = None
         self.calc_case = self.calc_case_entry.get()
 
     def load(self, event=None):
@@ -206,7 +209,9 @@ class App(ttk.Frame):
             data["trk_path"] = pkl_path
             temp.save(data)
 
-        load_df = file_inout.load_track_file(pkl_path)
+        temp = TempFile()
+        mmap_load = temp.get_mmap_load()
+        load_df = file_inout.load_track_file(pkl_path, mmap=mmap_load)
         if load_df is None:
             self.pkl_selector.rename_pkl_path_label(self.pkl_path)
             return
@@ -223,15 +228,18 @@ class App(ttk.Frame):
 
         self.pkl_path = pkl_path
         self.src_df = load_df
+        self.member_summary = None
         self.src_df = keypoints_proc.zero_point_to_nan(self.src_df)
-        self.src_df = self.src_df[~self.src_df.index.duplicated(keep="first")]
+        # mmapの配列は作成時に重複indexを削除済み
+        if mmap_load is False:
+            self.src_df = self.src_df[~self.src_df.index.duplicated(keep="first")]
         src_attrs = df_attrs.DfAttrs(self.src_df)
         self.pkl_dir = os.path.dirname(self.pkl_path)
-        self.vcap.set_frame_size(src_attrs.attrs["frame_size"])
+        self.multi_vcap.set_frame_size(src_attrs.attrs["frame_size"])
         if isinstance(src_attrs.attrs["video_name"], list):
             video_list = [os.path.abspath(os.path.join(self.pkl_dir, os.pardir, video)) for video in src_attrs.attrs["video_name"]]
-            self.cap = vcap.MultiVcap(self.vcap)
-            self.cap.open_files(video_list)
+            self.multi_vcap.open_files(video_list)
+            self.cap = self.multi_vcap
         else:
             self.vcap.open_file(os.path.join(self.pkl_dir, os.pardir, src_attrs.attrs["video_name"]))
             self.cap = self.vcap
@@ -300,7 +308,10 @@ class App(ttk.Frame):
             "time_span_msec": self.time_span,
             "cap": self.cap,
             "pkl_dir": self.pkl_dir,
+            # 編集して保存していなければsrc_dfはファイルと違うので、ファイルから読み直させない
+            "trk_path": self.pkl_path if self.save_button["state"] == tk.DISABLED else None,
             "current_position": current_position,
+            "member_summary": self.member_summary,
         }
         self.a = app(dlg_modal, args)
         dlg_modal.protocol(
@@ -322,6 +333,8 @@ class App(ttk.Frame):
 
         print("DataFrame Updated")
         self.src_df = self.a.dst_df
+        # Member Edit以外で変更された場合はmemberの集計を作り直す
+        self.member_summary = getattr(self.a, "member_summary", None)
         if "proc_history" not in self.src_df.attrs.keys():
             self.src_df.attrs["proc_history"] = []
         if self.a.history is not None:
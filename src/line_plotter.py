@@ -3,14 +3,13 @@ import time
 import cv2
 import matplotlib
 import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
 import PIL
 import seaborn as sns
 from matplotlib import gridspec, ticker
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
-from behavior_senpai import mediapipe_drawer, pose_drawer, time_format
+from behavior_senpai import mediapipe_drawer, pose_drawer, pose_frame_index, time_format, timestamp_index
 
 
 class LinePlotter:
@@ -68,9 +67,8 @@ class LinePlotter:
         elif trk_df.attrs["model"] == "DeepLabCut":
             self.anno = pose_drawer.Annotate("deeplabcut.toml")
             cols_for_anno = ["x", "y", "likelihood"]
-        self.anno_df = trk_df.reset_index().set_index(["timestamp", "member", "keypoint"]).loc[:, cols_for_anno]
-        self.anno_time_member_indexes = self.anno_df.index.droplevel(2).unique()
-        self.timestamps = self.anno_time_member_indexes.get_level_values("timestamp").unique().to_numpy()
+        self.pose_index = pose_frame_index.PoseFrameIndex(trk_df, cols_for_anno)
+        self.timestamp_index = timestamp_index.TimestampIndex(self.pose_index.timestamps)
         print(f"set_trk_df() (line_plotter.LinePlotter): {time.perf_counter() - start_time:.3f}sec")
 
     def set_plot(self, plot_df, member: str, data_col_names: list):
@@ -134,7 +132,7 @@ class LinePlotter:
         self.line_ax.grid(which="major", axis="x", linewidth=0.3)
 
         show_df = plot_df.reset_index().set_index(["timestamp", "member"]).loc[:, :]
-        self.timestamps = show_df.index.get_level_values("timestamp").unique().to_numpy()
+        self.timestamp_index = timestamp_index.TimestampIndex(show_df.index.get_level_values("timestamp").unique().to_numpy())
 
     def set_plot_rect(self, rects: list, time_min_msec: int, time_max_msec: int):
         # カラムごとにdtypeを指定してDataFrameを作成
@@ -222,8 +220,7 @@ class LinePlotter:
         if ret is False:
             return
 
-        idx = np.fabs(self.timestamps - timestamp_msec).argmin()
-        timestamp_msec = self.timestamps[idx]
+        timestamp_msec = self.timestamp_index.nearest(timestamp_msec)
 
         if self.draw_anno is True:
             canvas_height = self.img_canvas.winfo_height()
@@ -232,10 +229,11 @@ class LinePlotter:
 
             if len(self.members) == 0:
                 self.members = [self.member]
+            row = self.pose_index.timestamp_rows.get(timestamp_msec)
             for member in self.members:
-                if (timestamp_msec, member) in self.anno_time_member_indexes:
-                    tar_df = self.anno_df.loc[pd.IndexSlice[timestamp_msec, member, :], :]
-                    kps = tar_df.to_numpy()
+                kps = self.pose_index.get_kps(row, member)
+                if kps is not None:
+                    kps = kps.copy()
                     kps[:, :2] *= resize_ratio
                     self.anno.set_img(frame)
                     self.anno.set_pose(kps)
@@ -2,11 +2,9 @@ import os
 import tkinter as tk
 from tkinter import ttk
 
-import numpy as np
-import pandas as pd
 from PIL import Image, ImageTk
 
-from behavior_senpai import file_inout, mediapipe_drawer, pose_drawer
+from behavior_senpai import file_inout, mediapipe_drawer, pose_drawer, pose_frame_index, timestamp_index
 from gui_parts import TempFile
 
 
@@ -142,7 +140,7 @@ class CapCanvas(tk.Canvas):
         super().__init__(master, width=width, height=height, highlightthickness=0)
         self.height = height
         self.img_on_canvas = None
-        self.anno_df = None
+        self.pose_index = None
 
     def set_cap(self, cap, frame_size):
         self.cap = cap
@@ -168,23 +166,22 @@ class CapCanvas(tk.Canvas):
         elif src_df.attrs["model"] == "DeepLabCut":
             self.anno = pose_drawer.Annotate("deeplabcut.toml")
             cols_for_anno = ["x", "y", "likelihood"]
-        self.anno_df = src_df.reset_index().set_index(["timestamp", "member", "keypoint"]).loc[:, cols_for_anno]
-        self.timestamps = self.anno_df.index.get_level_values("timestamp").unique().to_numpy()
+        self.pose_index = pose_frame_index.PoseFrameIndex(src_df, cols_for_anno)
+        self.timestamp_index = timestamp_index.TimestampIndex(self.pose_index.timestamps)
 
     def scale_trk(self):
-        self.anno_df.loc[:, ["x", "y"]] *= self.scale
+        if self.pose_index is None:
+            return
+        self.pose_index.scale(self.scale)
 
     def update(self, msec):
-        msec = self.timestamps[np.fabs(self.timestamps - msec).argsort()[:1]][0]
+        msec = self.timestamp_index.nearest(msec)
         ok, image_rgb = self.cap.read_at(msec, scale=self.scale, rgb=True)
         if ok is False:
             return
-        if self.anno_df is not None:
-            tar_df = self.anno_df.loc[pd.IndexSlice[msec, :, :], :]
-            members = tar_df.index.get_level_values("member").unique().tolist()
-            for member in members:
-                member_df = tar_df.loc[pd.IndexSlice[:, member, :], :]
-                kps = member_df.to_numpy()
+        if self.pose_index is not None:
+            row = self.pose_index.timestamp_rows.get(msec)
+            for member, kps in self.pose_index.get_poses(row):
                 self.anno.set_img(image_rgb)
                 self.anno.set_pose(kps)
                 self.anno.set_track(member)
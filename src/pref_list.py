@@ -21,6 +21,8 @@ class App(ttk.Frame):
         top_width, top_height = tmp.get_top_window_size()
         mp4_scale = tmp.get_mp4_setting()
         draw_mask = tmp.get_draw_mask()
+        mmap_load = tmp.get_mmap_load()
+        mp4_preview = tmp.get_mp4_preview()
 
         pref_frame = ttk.Frame(self)
         pref_frame.pack()
@@ -28,6 +30,10 @@ class App(ttk.Frame):
         mask_chk = ttk.Checkbutton(pref_frame, text="Draw mask", variable=self.mask_chk_var)
         mask_chk.pack(side=tk.TOP, anchor=tk.W)
         self.mask_chk_var.set(draw_mask)
+        self.mmap_chk_var = tk.BooleanVar()
+        mmap_chk = ttk.Checkbutton(pref_frame, text="Memory-mapped loading", variable=self.mmap_chk_var)
+        mmap_chk.pack(side=tk.TOP, anchor=tk.W)
+        self.mmap_chk_var.set(mmap_load)
 
         self.top_height_entry = IntEntry(pref_frame, label="Top preview height:", default=top_height)
         self.top_height_entry.pack_vertical(pady=5, anchor=tk.W)
@@ -55,6 +61,10 @@ class App(ttk.Frame):
         self.mp4_scale_entry = ttk.Entry(mp4_frame, width=5, validate="key", validatecommand=(self.register(self._validate_float), "%P"))
         self.mp4_scale_entry.pack(side=tk.LEFT, padx=(0, 5))
         self.mp4_scale_entry.insert(tk.END, mp4_scale)
+        self.mp4_preview_chk_var = tk.BooleanVar()
+        mp4_preview_chk = ttk.Checkbutton(mp4_frame, text="Preview while exporting", variable=self.mp4_preview_chk_var)
+        mp4_preview_chk.pack(side=tk.LEFT)
+        self.mp4_preview_chk_var.set(mp4_preview)
 
         save_btn = ttk.Button(pref_frame, text="Save", command=self.save)
         save_btn.pack(side=tk.TOP)
@@ -71,6 +81,8 @@ class App(ttk.Frame):
         data["scene_table_dpi"] = self.st_graph_dpi_entry.get()
         data["mp4_scale"] = self.mp4_scale_entry.get()
         data["draw_mask"] = self.mask_chk_var.get()
+        data["mmap_load"] = self.mmap_chk_var.get()
+        data["mp4_preview"] = self.mp4_preview_chk_var.get()
         tmp.save(data)
         print("saved")
 
@@ -1,8 +1,6 @@
 import os
 import sys
 
-import pandas as pd
-
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from behavior_senpai import file_inout, time_format
 
@@ -12,7 +10,7 @@ DURATION_MSEC_THRESHOLD = 1000 * 60
 video_dir = "%USERPROFILE%/Videos"
 trk_path = file_inout.open_pkl(video_dir)
 
-trk_df = pd.read_pickle(trk_path)
+trk_df = file_inout.read_track_file(trk_path)
 
 print("member, start, end, duration")
 groups = trk_df.groupby("member")
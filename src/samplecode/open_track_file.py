@@ -3,10 +3,8 @@ import os
 import sys
 from tkinter import filedialog
 
-import pandas as pd
-
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
-from behavior_senpai import keypoints_proc, windows_and_mac
+from behavior_senpai import file_inout, keypoints_proc, windows_and_mac
 
 
 def load_pkl(tar_path):
@@ -14,7 +12,7 @@ def load_pkl(tar_path):
     if os.path.exists(tar_path) is False:
         print(f"File not found: {tar_path}")
         return
-    src_df = pd.read_pickle(tar_path)
+    src_df = file_inout.read_track_file(tar_path)
     frame_num = src_df.index.get_level_values(0).nunique()
     member_num = src_df.index.get_level_values(1).nunique()
     called_in = os.path.basename(inspect.stack()[1].filename)
@@ -25,7 +23,7 @@ def load_pkl(tar_path):
 # macは/Users/username
 video_dir = "%USERPROFILE%/Videos"
 
-filetypes = [("Track files", "*.pkl")]
+filetypes = [("Track files", "*.trk;*.pkl")]
 filetypes = windows_and_mac.file_types(filetypes)
 trk_path = filedialog.askopenfilename(initialdir=video_dir, title="Select Pickle file", filetypes=filetypes)
 if trk_path == "":